@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import URLPattern
+
+from . import profiling
+
+ASGI_URLCONF = 'foodgram.urls_asgi'
+
+# Маршруты чтения, которые под ASGI обслуживает пул потоков
+ASYNC_ROUTES = {'recipe-list', 'recipe-detail', 'tag-list', 'tag-detail',
+                'ingredient-list', 'ingredient-detail'}
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.ASGI_READ_THREADS,
+                    thread_name_prefix='asgi-read'
+                )
+    return _executor
+
+
+def run_in_pool(view, request, *args, **kwargs):
+    """ Выполняет представление и рендер ответа в потоке пула.
+        У потоков пула свои соединения с БД, устаревшие закрываются
+        до и после запроса, как это делают сигналы запроса для WSGI.
+    """
+    close_old_connections()
+    try:
+        with profiling.track_queries():
+            response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+            # Без render() Django не передаёт готовый ответ
+            # в общий синхронный поток ещё раз.
+            response = HttpResponse(response.content,
+                                    status=response.status_code,
+                                    headers=dict(response.items()))
+        return response
+    finally:
+        close_old_connections()
+
+
+def in_pool(view):
+    """ async-вариант синхронного представления DRF. Django 3.2 не
+        умеет асинхронно обращаться к ORM, поэтому запросы на чтение
+        выполняются в пуле из ASGI_READ_THREADS потоков, а не в одном
+        общем потоке для синхронного кода: медленные клиенты и отдача
+        ответа не занимают поток. Запросы на запись идут в синхронное
+        представление обычным путём.
+    """
+    read = sync_to_async(run_in_pool, thread_sensitive=False,
+                         executor=get_executor())
+    write = sync_to_async(view)
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await read(view, request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+    return async_view
+
+
+def async_patterns(patterns):
+    """ Маршруты роутера, в которых маршруты чтения заменены
+        async-вариантами.
+    """
+    return [
+        URLPattern(pattern.pattern, in_pool(pattern.callback),
+                   pattern.default_args, pattern.name)
+        if pattern.name in ASYNC_ROUTES else pattern
+        for pattern in patterns
+    ]
+
+
+class AsyncRoutesMiddleware:
+    """ При ASGI_READ_ROUTES направляет запросы, пришедшие через ASGI,
+        в ASGI_URLCONF. Запросы WSGI и тесты разбираются ROOT_URLCONF.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ASGI_READ_ROUTES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if isinstance(request, ASGIRequest):
+            request.urlconf = ASGI_URLCONF
+        return self.get_response(request)
@@ -0,0 +1,126 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import SAFE_METHODS
+
+from . import cache
+
+
+class LocalCache:
+    """ LRU-кэш в памяти процесса с ограниченным временем жизни записей. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, size):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + timeout)
+            self.items.move_to_end(key)
+            while len(self.items) > size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+local_cache = LocalCache()
+
+
+def token_key(key):
+    return f'auth:token:{cache.digest(key)}'
+
+
+def generation_key(key):
+    return f'auth:generation:{cache.digest(key)}'
+
+
+def invalidate(*keys):
+    """ Удаляет токены из кэшей. Кэши других процессов очищаются
+        не позже чем через AUTH_LOCAL_CACHE_TIMEOUT секунд.
+    """
+    cache_keys = [token_key(key) for key in keys]
+    for cache_key in cache_keys:
+        local_cache.delete(cache_key)
+    # Новое поколение отбрасывает записи, которые запрос, прочитавший
+    # токен из БД до выхода, положит в кэш уже после удаления. Поколение
+    # живёт дольше любой такой записи.
+    shared_cache.set_many(
+        {generation_key(key): uuid.uuid4().hex for key in keys},
+        2 * settings.AUTH_CACHE_TIMEOUT)
+    shared_cache.delete_many(cache_keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication без запроса к БД на каждый запрос чтения:
+        токен вместе с пользователем берётся из LRU-кэша процесса
+        (AUTH_LOCAL_CACHE_TIMEOUT секунд), затем из общего кэша
+        (AUTH_CACHE_TIMEOUT секунд). Записи удаляются при удалении
+        токена (выход) и при сохранении пользователя: смене пароля,
+        роли или деактивации. Запросы на запись и запросы при кэше,
+        которого не видят другие процессы, читают пользователя из БД:
+        устаревший объект не должен сохраниться поверх новых данных.
+    """
+    cached = True
+
+    def authenticate(self, request):
+        self.cached = request.method in SAFE_METHODS and cache.enabled()
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.cached:
+            return super().authenticate_credentials(key)
+        cache_key = token_key(key)
+        token = local_cache.get(cache_key)
+        cache.record('auth-local', token is not None)
+        if token is None:
+            # Поколение читается до запроса к БД и сохраняется вместе
+            # с токеном: запись из другого поколения считается промахом.
+            values = shared_cache.get_many(
+                [cache_key, generation_key(key)])
+            generation = values.get(generation_key(key))
+            token = None
+            if cache_key in values and values[cache_key][0] == generation:
+                token = values[cache_key][1]
+            cache.record('auth', token is not None)
+            if token is None:
+                user, token = super().authenticate_credentials(key)
+                shared_cache.set(cache_key, (generation, token),
+                                 settings.AUTH_CACHE_TIMEOUT)
+            if settings.AUTH_LOCAL_CACHE_TIMEOUT:
+                local_cache.set(cache_key, token,
+                                settings.AUTH_LOCAL_CACHE_TIMEOUT,
+                                settings.AUTH_LOCAL_CACHE_SIZE)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        # Запросы получают свои копии: объект из кэша процесса
+        # не должен меняться представлениями других потоков.
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token.user, token
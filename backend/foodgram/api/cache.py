@@ -0,0 +1,139 @@
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Value
+
+VERSION_TIMEOUT = None
+
+# Кэши, которые видит только текущий процесс
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Счётчики попаданий и промахов кэша в текущем процессе
+stats = Counter()
+
+
+def record(group, hit):
+    stats[f'{group}:{"hit" if hit else "miss"}'] += 1
+
+
+def digest(value):
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def is_shared():
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_BACKENDS
+
+
+def enabled():
+    """ Данные между запросами (ответы, флаги, токены) кэшируются
+        только в общем кэше или в единственном процессе: поколение
+        или удаление ключа в одном процессе не видно кэшам в памяти
+        других процессов.
+    """
+    return is_shared() or settings.WEB_WORKERS <= 1
+
+
+def version_key(group):
+    return f'version:{group}'
+
+
+def get_version(group):
+    return cache.get_or_set(version_key(group), 1, VERSION_TIMEOUT)
+
+
+def bump_version(group):
+    """ Делает недействительными все ключи группы за одну операцию:
+        старые записи перестают читаться и вытесняются по таймауту.
+    """
+    key = version_key(group)
+    cache.add(key, 1, VERSION_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, VERSION_TIMEOUT)
+
+
+def response_key(group, request):
+    request_digest = digest(
+        f'{request.build_absolute_uri()}|{request.META.get("HTTP_ACCEPT", "")}'
+    )
+    return f'response:{group}:{get_version(group)}:{request_digest}'
+
+
+def get_response(group, request):
+    if not enabled():
+        return None
+    cached = cache.get(response_key(group, request))
+    record(group, cached is not None)
+    return cached
+
+
+def set_response(group, request, content, content_type):
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    cached = (etag, content, content_type)
+    if enabled():
+        cache.set(response_key(group, request), cached,
+                  settings.RESPONSE_CACHE_TIMEOUT)
+    return cached
+
+
+def get_data(group, request):
+    if not enabled():
+        return None
+    data = cache.get(response_key(group, request))
+    record(group, data is not None)
+    return data
+
+
+def set_data(group, request, data):
+    if not enabled():
+        return
+    cache.set(response_key(group, request), data,
+              settings.RESPONSE_CACHE_TIMEOUT)
+
+
+def user_group(user_id):
+    return f'user:{user_id}'
+
+
+def load_user_flags(user, recipe_ids, author_ids):
+    """ Множества id рецептов из избранного и корзины и id авторов,
+        на которых подписан пользователь, одним запросом.
+    """
+    flags = (set(), set(), set())
+    favorites = user.favorite_list.through.objects.filter(
+        user_id=user.id, recipe_id__in=recipe_ids
+    ).annotate(kind=Value(0)).values_list('kind', 'recipe_id')
+    cart = user.cart.through.objects.filter(
+        user_id=user.id, recipe_id__in=recipe_ids
+    ).annotate(kind=Value(1)).values_list('kind', 'recipe_id')
+    following = user.follower.filter(
+        author_id__in=author_ids
+    ).order_by().annotate(kind=Value(2)).values_list('kind', 'author_id')
+    for kind, pk in favorites.union(cart, following, all=True):
+        flags[kind].add(pk)
+    return flags
+
+
+def get_user_flags(user, recipe_ids, author_ids):
+    """ Возвращает множества id рецептов из избранного и корзины
+        и id авторов, на которых подписан пользователь, среди переданных.
+        Ключ зависит от поколения пользователя, которое меняется при
+        изменении его избранного, корзины или подписок.
+    """
+    if not enabled():
+        return load_user_flags(user, recipe_ids, author_ids)
+    group = user_group(user.id)
+    key = (f'flags:{user.id}:{get_version(group)}:'
+           f'{digest(f"{recipe_ids}|{author_ids}")}')
+    flags = cache.get(key)
+    record('recipe-flags', flags is not None)
+    if flags is None:
+        flags = load_user_flags(user, recipe_ids, author_ids)
+        cache.set(key, flags, settings.RESPONSE_CACHE_TIMEOUT)
+    return flags
@@ -1,13 +1,133 @@
 import base64
+import binascii
+import re
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from PIL import Image
 from rest_framework import serializers
 
+DATA_URI = re.compile(r'data:image/[a-z0-9.+-]+;base64,')
+WHITESPACE = re.compile(r'\s+')
+
+# Кратно 4, чтобы каждый кусок декодировался независимо
+CHUNK_SIZE = 64 * 1024
+
 
 class Base64ImageField(serializers.ImageField):
+    """ Изображение в виде data URI.
+        Размер проверяется до декодирования, данные декодируются кусками
+        во временный файл, который уходит на диск после
+        FILE_UPLOAD_MAX_MEMORY_SIZE байт. Pillow проверяет только
+        заголовок и структуру файла, не загружая пиксели. Переводы строк
+        (base64 в формате MIME) пропускаются, другие символы вне
+        алфавита base64 — ошибка.
+    """
+    default_error_messages = {
+        **serializers.ImageField.default_error_messages,
+        'invalid_base64': 'Некорректные данные изображения в base64.',
+        'too_large': 'Размер изображения превышает {max_size} байт.',
+    }
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        if isinstance(data, str) and data.startswith('data:'):
+            return serializers.FileField.to_internal_value(
+                self, self.decode(data))
         return super().to_internal_value(data)
+
+    def decode(self, data):
+        header = DATA_URI.match(data)
+        if header is None:
+            self.fail('invalid_base64')
+        start = header.end()
+        if WHITESPACE.search(data, start):
+            data = data[:start] + WHITESPACE.sub('', data[start:])
+        padding = data[-2:].count('=')
+        if (len(data) - start) * 3 // 4 - padding > (
+                settings.IMAGE_UPLOAD_MAX_SIZE):
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            for offset in range(start, len(data), CHUNK_SIZE):
+                file.write(base64.b64decode(
+                    data[offset:offset + CHUNK_SIZE], validate=True))
+            file.seek(0)
+            with Image.open(file) as image:
+                image_format = image.format
+                image.verify()
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_base64')
+        except Exception:
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        return File(file, name=f'temp.{image_format.lower()}')
+
+
+class ImageVariantField(serializers.ReadOnlyField):
+    """ Ссылка на вариант изображения рецепта.
+        Пока вариант не готов, отдаётся ссылка на оригинал.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, recipe):
+        return (getattr(recipe, self.variant) or recipe.image).url
+
+
+class ImportImageField(serializers.ImageField):
+    """ Изображение строки импорта: имя файла, который открывает
+        функция context['open_image'].
+    """
+    default_error_messages = {
+        **Base64ImageField.default_error_messages,
+        'not_found': 'Файл изображения "{name}" не найден.',
+    }
+
+    def to_internal_value(self, name):
+        if not isinstance(name, str) or not name:
+            self.fail('invalid')
+        file = self.context['open_image'](name)
+        if file is None:
+            self.fail('not_found', name=name)
+        if file.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+        return super().to_internal_value(file)
+
+
+class PrimaryKeyListField(serializers.ManyRelatedField):
+    """ Список первичных ключей объектов queryset. Объекты загружаются
+        одним запросом in_bulk, а не отдельным запросом на каждый ключ.
+    """
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(
+            child_relation=serializers.PrimaryKeyRelatedField(
+                queryset=queryset),
+            **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        queryset = self.child_relation.get_queryset()
+        pks = []
+        for pk in data:
+            try:
+                pks.append(queryset.model._meta.pk.to_python(pk))
+            except (TypeError, ValueError, DjangoValidationError):
+                self.child_relation.fail('incorrect_type',
+                                         data_type=type(pk).__name__)
+        found = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in found:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [found[pk] for pk in pks]
@@ -1,4 +1,4 @@
-from django.db.models import Q
+from django.conf import settings
 from django_filters import rest_framework as filters
 
 from app.models import Ingredient, Recipe, Tag
@@ -16,30 +16,32 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         field_name='cart',
         method='filter_is_in_shopping_cart')
+    ordering = filters.ChoiceFilter(choices=(('popular', 'популярные'),),
+                                    method='filter_ordering')
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'ordering']
 
     def filter_is_favorited(self, queryset, name, value):
-        value = bool(int(value))
-        user_fav_list = self.request.user.favorite_list.all()
-        if value:
-            return queryset.filter(id__in=user_fav_list)
-        return queryset.filter(~Q(id__in=user_fav_list))
+        return queryset.in_user_list('user_favorite', self.request.user,
+                                     value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        value = bool(int(value))
-        user_cart_list = self.request.user.cart.all()
-        if value:
-            return queryset.filter(id__in=user_cart_list)
-        return queryset.filter(~Q(id__in=user_cart_list))
+        return queryset.in_user_list('user_cart', self.request.user, value)
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*Recipe.POPULAR_ORDERING)
 
 
 class IngredientFilter(filters.FilterSet):
     """Фильтр по полям объекта модели ингредиента"""
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ['name']
+
+    def filter_name(self, queryset, name, value):
+        return queryset.search(value, settings.INGREDIENT_SEARCH_LIMIT)
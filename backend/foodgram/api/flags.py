@@ -0,0 +1,43 @@
+from . import cache
+
+
+class UserFlags:
+    """ Избранное, корзина и подписки пользователя запроса среди
+        выводимых объектов. Флаги загружаются одним запросом на страницу
+        и только для ещё не проверенных id, дальше проверяются по множествам.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.recipe_ids = set()
+        self.author_ids = set()
+        self.favorites = set()
+        self.cart = set()
+        self.following = set()
+
+    def load(self, recipe_ids=(), author_ids=()):
+        if not self.user.is_authenticated:
+            return
+        recipe_ids = set(recipe_ids) - self.recipe_ids
+        author_ids = set(author_ids) - self.author_ids
+        if not recipe_ids and not author_ids:
+            return
+        favorites, cart, following = cache.get_user_flags(
+            self.user, sorted(recipe_ids), sorted(author_ids))
+        self.favorites |= favorites
+        self.cart |= cart
+        self.following |= following
+        self.recipe_ids |= recipe_ids
+        self.author_ids |= author_ids
+
+    def is_favorited(self, recipe_id):
+        self.load(recipe_ids=[recipe_id])
+        return recipe_id in self.favorites
+
+    def is_in_shopping_cart(self, recipe_id):
+        self.load(recipe_ids=[recipe_id])
+        return recipe_id in self.cart
+
+    def is_subscribed(self, author_id):
+        self.load(author_ids=[author_id])
+        return author_id in self.following
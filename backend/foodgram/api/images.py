@@ -0,0 +1,84 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import get_thumbnail
+
+from . import cache
+from app.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Поле модели -> формат варианта изображения
+VARIANTS = {
+    'thumbnail': 'JPEG',
+    'thumbnail_webp': 'WEBP',
+}
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                    thread_name_prefix='recipe-images'
+                )
+    return _executor
+
+
+def schedule(recipe_id):
+    """ Ставит обработку изображения рецепта в очередь после коммита
+        транзакции. При IMAGE_PROCESSING_WORKERS = 0 варианты
+        создаются сразу в потоке запроса.
+    """
+    if settings.IMAGE_PROCESSING_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_worker, recipe_id))
+    else:
+        transaction.on_commit(lambda: process(recipe_id))
+
+
+def run_in_worker(recipe_id):
+    close_old_connections()
+    try:
+        process(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать изображение рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def make_variants(image):
+    """ Создаёт миниатюры через sorl-thumbnail. Повторный вызов для того же
+        исходника берёт готовые файлы из хранилища ключей sorl.
+    """
+    return {
+        field: get_thumbnail(
+            image, settings.RECIPE_THUMBNAIL_SIZE, crop='center',
+            format=image_format, quality=settings.RECIPE_THUMBNAIL_QUALITY
+        ).name
+        for field, image_format in VARIANTS.items()
+    }
+
+
+def process(recipe_id):
+    recipe = Recipe.objects.filter(id=recipe_id).first()
+    if recipe is None or not recipe.image:
+        return False
+    variants = make_variants(recipe.image)
+    if all(getattr(recipe, field).name == name
+           for field, name in variants.items()):
+        return False
+    # update() не отправляет post_save и не запускает обработку повторно.
+    Recipe.objects.filter(id=recipe_id, image=recipe.image.name).update(
+        **variants)
+    cache.bump_version('recipes')
+    return True
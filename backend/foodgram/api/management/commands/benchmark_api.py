@@ -0,0 +1,401 @@
+import base64
+import csv
+import json
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .compare_recipe_serializers import compare
+from api import metrics, recommendations
+from api.pagination import RecipePagination
+from api.signals import process_recipe_image
+from app.models import (Ingredient, Recipe, RecipeIngredient, RecipeSimilarity,
+                        ShoppingListItem, Subscription, Tag)
+
+User = get_user_model()
+
+INGREDIENTS_CSV = (Path(settings.BASE_DIR).parent.parent
+                   / 'infra' / 'db_data' / 'ingredients.csv')
+
+GIF = base64.b64encode(
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+).decode()
+
+BATCH_SIZE = 5000
+
+# Кэш процесса: замер не зависит от Redis и не пишет в общий кэш
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+NO_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+
+
+class Scenario:
+    """ Замер одного маршрута API с допустимым числом запросов к БД. """
+
+    def __init__(self, name, method, path, budget, payload=None, auth=True,
+                 cache=True):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.budget = budget
+        self.payload = payload
+        self.auth = auth
+        self.cache = cache
+
+    def request(self, client, data):
+        path = self.path(data) if callable(self.path) else self.path
+        payload = self.payload(data) if callable(self.payload) else None
+        response = getattr(client, self.method)(path, payload, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+
+def recipe_payload(data):
+    return {
+        'name': 'Бенчмарк',
+        'text': 'Текст',
+        'cooking_time': 10,
+        'image': f'data:image/gif;base64,{GIF}',
+        'tags': data['tag_ids'][:2],
+        'ingredients': [{'id': pk, 'amount': 10}
+                        for pk in data['ingredient_ids'][:5]],
+    }
+
+
+SCENARIOS = [
+    Scenario('recipes-list-anon', 'get', '/api/recipes/?limit=6', 5,
+             auth=False),
+    Scenario('recipes-list', 'get', '/api/recipes/?limit=6', 6),
+    Scenario('recipes-list-50', 'get', '/api/recipes/?limit=50', 6),
+    Scenario('recipes-list-filtered', 'get',
+             '/api/recipes/?limit=6&is_favorited=1&tags=breakfast', 6),
+    Scenario('recipes-deep-page', 'get',
+             lambda data: f'/api/recipes/?limit=6&page={data["deep_page"]}',
+             5, auth=False, cache=False),
+    Scenario('recipes-deep-cursor', 'get',
+             lambda data: ('/api/recipes/?limit=6'
+                           f'&cursor={data["deep_cursor"]}'),
+             4, auth=False, cache=False),
+    Scenario('recipes-popular', 'get',
+             '/api/recipes/?limit=6&ordering=popular', 5, auth=False),
+    Scenario('recipes-retrieve', 'get',
+             lambda data: f'/api/recipes/{data["recipe_id"]}/', 4),
+    Scenario('recipes-similar', 'get',
+             lambda data: f'/api/recipes/{data["similar_recipe_id"]}/similar/',
+             1, auth=False),
+    Scenario('recipes-create', 'post', '/api/recipes/', 12,
+             payload=recipe_payload),
+    # Худший случай (prepare_update) без кэшей: токен, рецепт с автором,
+    # теги, ингредиенты, BEGIN, UPDATE рецепта, 3 на теги, 4 на
+    # ингредиенты, 6 на списки покупок корзин и 4 на ответ. От числа
+    # корзин, тегов и ингредиентов не зависит.
+    Scenario('recipes-update', 'patch',
+             lambda data: f'/api/recipes/{data["own_recipe_id"]}/', 23,
+             payload=recipe_payload),
+    Scenario('users-list', 'get', '/api/users/', 2),
+    Scenario('subscriptions', 'get', '/api/users/subscriptions/?limit=6',
+             3),
+    Scenario('ingredients-search', 'get', '/api/ingredients/?name=а', 1),
+    Scenario('tags', 'get', '/api/tags/', 1),
+    Scenario('shopping-list', 'get', '/api/recipes/shopping_list/', 1),
+    Scenario('download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', 1),
+    Scenario('download-shopping-cart-csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', 1),
+]
+
+
+def read_ingredients(path):
+    if path.exists():
+        with open(path, encoding='utf-8') as file:
+            return [(name, unit) for name, unit in csv.reader(file)]
+    return [(f'ингредиент {i}', 'г') for i in range(2000)]
+
+
+def seed(options, rand):
+    """ Заполняет БД синтетическими данными для замеров. """
+    password = make_password('benchmark')
+    User.objects.bulk_create([
+        User(email=f'user{i}@bench.ru', username=f'user{i}',
+             first_name='Имя', last_name='Фамилия', password=password)
+        for i in range(options['users'])
+    ], batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.values_list('id', flat=True))
+
+    Tag.objects.bulk_create([
+        Tag(name='Завтрак', color='#E26C2D', slug='breakfast'),
+        Tag(name='Обед', color='#49B64E', slug='dinner'),
+        Tag(name='Ужин', color='#8775D2', slug='supper'),
+    ])
+    tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+    Ingredient.objects.bulk_create([
+        Ingredient(name=name, measurement_unit=unit)
+        for name, unit in read_ingredients(Path(options['ingredients']))
+    ], batch_size=BATCH_SIZE)
+    ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+    Recipe.objects.bulk_create([
+        Recipe(author_id=rand.choice(user_ids), name=f'Рецепт {i}',
+               text='Описание', cooking_time=rand.randint(1, 120),
+               image='recipes/benchmark.gif')
+        for i in range(options['recipes'])
+    ], batch_size=BATCH_SIZE)
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=rand.randint(1, 500))
+        for recipe_id in recipe_ids
+        for ingredient_id in rand.sample(ingredient_ids, rand.randint(3, 10))
+    ], batch_size=BATCH_SIZE)
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+        for recipe_id in recipe_ids
+        for tag_id in rand.sample(tag_ids, rand.randint(1, 3))
+    ], batch_size=BATCH_SIZE)
+
+    for through, per_user in ((User.favorite_list.through, 20),
+                              (User.cart.through, 5)):
+        through.objects.bulk_create([
+            through(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in rand.sample(recipe_ids,
+                                         rand.randint(0, per_user))
+        ], batch_size=BATCH_SIZE)
+    Recipe.objects.recount()
+    ShoppingListItem.objects.rebuild()
+    recommendations.build()
+    Subscription.objects.bulk_create([
+        Subscription(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in rand.sample(user_ids, rand.randint(0, 10))
+        if author_id != user_id
+    ], batch_size=BATCH_SIZE)
+
+    user = User.objects.get(pk=user_ids[0])
+    Subscription.objects.filter(user=user).delete()
+    Subscription.objects.bulk_create([
+        Subscription(user=user, author_id=author_id)
+        for author_id in user_ids[1:51]
+    ])
+    own_recipe = Recipe.objects.filter(author=user).first()
+    if own_recipe is None:
+        own_recipe = Recipe.objects.create(
+            author=user, name='Свой рецепт', text='Описание',
+            cooking_time=10, image='recipes/benchmark.gif')
+    prepare_update(own_recipe, user_ids[1:6], tag_ids, ingredient_ids)
+    deep_page = len(recipe_ids) // 6
+    deep_recipe = Recipe.objects.all()[(deep_page - 1) * 6 - 1]
+    return {
+        'user': user,
+        'deep_page': deep_page,
+        'deep_cursor': RecipePagination().encode_cursor(deep_recipe, False),
+        'token': Token.objects.create(user=user).key,
+        'recipe_id': recipe_ids[len(recipe_ids) // 2],
+        'own_recipe_id': own_recipe.id,
+        'similar_recipe_id': RecipeSimilarity.objects.values_list(
+            'recipe_id', flat=True).first(),
+        'tag_ids': tag_ids,
+        'ingredient_ids': ingredient_ids,
+    }
+
+
+def prepare_update(recipe, cart_user_ids, tag_ids, ingredient_ids):
+    """ Приводит рецепт к худшему для recipes-update случаю независимо
+        от случайных данных: рецепт лежит в корзинах, а recipe_payload
+        удаляет, меняет и добавляет и теги, и ингредиенты.
+    """
+    recipe.tags.set(tag_ids[1:3])
+    RecipeIngredient.objects.filter(recipe=recipe).delete()
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                         amount=20)
+        for ingredient_id in ingredient_ids[2:8]
+    ])
+    User.cart.through.objects.bulk_create([
+        User.cart.through(user_id=user_id, recipe_id=recipe.id)
+        for user_id in cart_user_ids
+    ], ignore_conflicts=True)
+    Recipe.objects.filter(id=recipe.id).recount()
+    ShoppingListItem.objects.rebuild(cart_user_ids)
+
+
+def parse_metrics(text):
+    """ Сэмплы текстового формата Prometheus: {(имя, метки): значение}. """
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        samples[(name, labels.rstrip('}'))] = float(value)
+    return samples
+
+
+def check_metrics(scenarios, repeat):
+    """ Сверяет счётчики /metrics с выполненной нагрузкой: каждый
+        сценарий отправил repeat + 1 запросов.
+    """
+    response = APIClient().get('/metrics')
+    samples = parse_metrics(response.content.decode())
+    requests = sum(value for (name, labels), value in samples.items()
+                   if name == 'foodgram_http_requests_total'
+                   and 'route="metrics"' not in labels)
+    expected = len(scenarios) * (repeat + 1)
+    requests_count = sum(
+        value for (name, labels), value in samples.items()
+        if name == 'foodgram_http_request_duration_seconds_count'
+        and 'route="metrics"' not in labels)
+    queries = sum(value for (name, _), value in samples.items()
+                  if name == 'foodgram_db_query_duration_seconds_count')
+    return {
+        'status': response.status_code,
+        'series': len(samples),
+        'requests': requests,
+        'expected_requests': expected,
+        'db_queries': queries,
+        'ok': (response.status_code == 200 and requests == expected
+               and requests_count == expected),
+    }
+
+
+def measure(scenario, client, data, repeat):
+    if not scenario.cache:
+        with override_settings(CACHES=NO_CACHE):
+            return run_scenario(scenario, client, data, repeat)
+    return run_scenario(scenario, client, data, repeat)
+
+
+def run_scenario(scenario, client, data, repeat):
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as context:
+        response = scenario.request(client, data)
+    queries = len(context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scenario.request(client, data)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'name': scenario.name,
+        'method': scenario.method.upper(),
+        'status': response.status_code,
+        'queries': queries,
+        'budget': scenario.budget,
+        'ok': queries <= scenario.budget,
+        'peak_kib': round(peak / 1024, 1),
+        'wall_ms': {
+            'min': round(timings[0], 2),
+            'median': round(statistics.median(timings), 2),
+            'p95': round(timings[int(len(timings) * 0.95) - 1], 2),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = ('Замеряет число запросов, время и память для маршрутов API '
+            'на синтетических данных во временной БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--ingredients', default=str(INGREDIENTS_CSV),
+                            help='CSV-файл с ингредиентами')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='*', default=None,
+                            help='Имена сценариев для замера')
+        parser.add_argument('--output', default=None,
+                            help='Файл для JSON-отчёта, иначе stdout')
+
+    def handle(self, *args, **options):
+        scenarios = [scenario for scenario in SCENARIOS
+                     if not options['only']
+                     or scenario.name in options['only']]
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            # Миниатюры создаются в фоновом пуле вне запроса и в замер
+            # не входят, а его потоки конкурировали бы за SQLite в памяти.
+            post_save.disconnect(process_recipe_image, sender=Recipe)
+            with override_settings(CACHES=LOCAL_CACHE,
+                                   MEDIA_ROOT=tempfile.mkdtemp(),
+                                   METRICS_DIR=tempfile.mkdtemp()):
+                report = self.run(scenarios, options)
+        finally:
+            post_save.connect(process_recipe_image, sender=Recipe)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(content, encoding='utf-8')
+        else:
+            self.stdout.write(content)
+
+        if report['metrics'] and not report['metrics']['ok']:
+            raise CommandError('Счётчики /metrics не совпадают с нагрузкой')
+        if report['compiled_serializer']['mismatches']:
+            raise CommandError('Вывод компилированного сериализатора '
+                               'отличается от RecipeReadSerializer')
+        failed = [route['name'] for route in report['routes']
+                  if not route['ok']]
+        if failed:
+            raise CommandError(
+                f'Превышен бюджет запросов: {", ".join(failed)}')
+
+    def run(self, scenarios, options):
+        start = time.perf_counter()
+        data = seed(options, random.Random(options['seed']))
+        dataset = {
+            'vendor': connection.vendor,
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'ingredients': Ingredient.objects.count(),
+            'subscriptions': Subscription.objects.count(),
+            'favorites': User.favorite_list.through.objects.count(),
+            'carts': User.cart.through.objects.count(),
+            'seed_seconds': round(time.perf_counter() - start, 2),
+        }
+        self.stderr.write(f'Данные подготовлены: {dataset}')
+
+        metrics.reset()
+        routes = []
+        for scenario in scenarios:
+            client = APIClient()
+            if scenario.auth:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {data["token"]}')
+            routes.append(measure(scenario, client, data, options['repeat']))
+        serializers = compare([AnonymousUser(), data['user']], pages=2,
+                              limit=50, repeat=options['repeat'])
+        return {'dataset': dataset, 'routes': routes,
+                'metrics': (check_metrics(scenarios, options['repeat'])
+                            if settings.METRICS_ENABLED else None),
+                'compiled_serializer': serializers}
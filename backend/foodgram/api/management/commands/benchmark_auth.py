@@ -0,0 +1,94 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as shared_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import (CachedTokenAuthentication, local_cache,
+                                token_key)
+
+
+def clear_local(key):
+    local_cache.clear()
+
+
+def clear_all(key):
+    local_cache.clear()
+    shared_cache.delete(token_key(key))
+
+
+# Режим -> (класс аутентификации, что очищать перед каждым запросом)
+MODES = {
+    'token': (TokenAuthentication, None),
+    'cached-miss': (CachedTokenAuthentication, clear_all),
+    'cached-shared': (CachedTokenAuthentication, clear_local),
+    'cached-local': (CachedTokenAuthentication, None),
+}
+
+
+def run_mode(mode, key, requests):
+    authentication, clear = MODES[mode]
+    http_request = APIRequestFactory().get(
+        '/', HTTP_AUTHORIZATION=f'Token {key}')
+    timings = []
+    local_cache.clear()
+    authentication().authenticate(Request(http_request))
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(requests):
+            if clear:
+                clear(key)
+            request = Request(http_request)
+            start = time.perf_counter()
+            authentication().authenticate(request)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    return {
+        'mode': mode,
+        'queries_per_request': round(len(queries) / requests, 2),
+        'us': {
+            'median': round(statistics.median(timings), 1),
+            'p99': round(timings[max(int(len(timings) * 0.99) - 1, 0)], 1),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стоимость аутентификации по токену на запрос: '
+            'TokenAuthentication и CachedTokenAuthentication при промахе, '
+            'из общего кэша и из кэша процесса')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='id пользователя, по умолчанию первый')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--modes', nargs='*', choices=list(MODES),
+                            default=list(MODES))
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(is_active=True)
+        user = (users.filter(id=options['user']) if options['user']
+                else users.order_by('id')).first()
+        if user is None:
+            raise CommandError('Нет активных пользователей')
+        token, created = Token.objects.get_or_create(user=user)
+        try:
+            modes = [run_mode(mode, token.key, options['requests'])
+                     for mode in options['modes']]
+        finally:
+            # Токен, выданный только для замера, не должен остаться в БД
+            if created:
+                token.delete()
+        self.stdout.write(json.dumps({
+            'vendor': connection.vendor,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'modes': modes,
+        }, ensure_ascii=False, indent=2))
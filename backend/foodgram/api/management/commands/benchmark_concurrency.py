@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PATHS = ['/api/recipes/?limit=6', '/api/tags/', '/api/ingredients/?name=а']
+
+# Имя цели -> приложение и аргументы gunicorn для --serve
+SERVERS = {
+    'wsgi': ['foodgram.wsgi:application'],
+    'asgi': ['foodgram.asgi:application',
+             '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+# Переменные окружения сервера поверх текущих
+SERVER_ENV = {
+    'asgi': {'ASGI_READ_ROUTES': 'True'},
+}
+
+
+async def fetch(url, read_delay):
+    """ GET по HTTP/1.1 без сторонних клиентов. read_delay задаёт паузу
+        между чтениями ответа: так ведут себя медленные клиенты.
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname,
+                                                   parts.port or 80)
+    path = quote(parts.path + (f'?{parts.query}' if parts.query else ''),
+                 safe='/?=&%')
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                 f'Connection: close\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    while await reader.read(16 * 1024):
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def client(base_url, paths, requests, read_delay, results):
+    for number in range(requests):
+        start = time.perf_counter()
+        try:
+            status = await fetch(base_url + paths[number % len(paths)],
+                                 read_delay)
+        except (OSError, IndexError, ValueError):
+            status = None
+        results.append((status, (time.perf_counter() - start) * 1000))
+
+
+async def load(base_url, options):
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(base_url, options['paths'], options['requests'],
+               options['read_delay'], results)
+        for _ in range(options['clients'])
+    ])
+    elapsed = time.perf_counter() - start
+    timings = sorted(ms for status, ms in results if status == 200)
+    report = {
+        'requests': len(results),
+        'errors': len(results) - len(timings),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+    }
+    if timings:
+        report['ms'] = {
+            'median': round(statistics.median(timings), 1),
+            'p99': round(timings[max(int(len(timings) * 0.99) - 1, 0)], 1),
+            'max': round(timings[-1], 1),
+        }
+    return report
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            asyncio.run(fetch(base_url + '/api/tags/', 0))
+            return
+        except (OSError, IndexError):
+            time.sleep(0.2)
+    raise CommandError(f'Сервер {base_url} не запустился')
+
+
+class Command(BaseCommand):
+    help = ('Нагружает маршруты чтения множеством одновременных клиентов '
+            'и сравнивает пропускную способность и p99 задержки '
+            'WSGI и ASGI серверов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', default=[],
+                            metavar='ИМЯ=URL',
+                            help='Уже запущенный сервер, например '
+                                 'asgi=http://127.0.0.1:8001')
+        parser.add_argument('--serve', action='store_true',
+                            help='Запустить gunicorn для wsgi и asgi '
+                                 'на свободных портах')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Процессов gunicorn для --serve')
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=10,
+                            help='Запросов от каждого клиента')
+        parser.add_argument('--read-delay', type=float, default=0,
+                            help='Пауза между чтениями ответа, секунды')
+        parser.add_argument('--paths', nargs='*', default=PATHS)
+
+    def handle(self, *args, **options):
+        targets = dict(target.split('=', 1) for target in options['target'])
+        processes = []
+        try:
+            if options['serve']:
+                for name, arguments in SERVERS.items():
+                    port = free_port()
+                    targets[name] = f'http://127.0.0.1:{port}'
+                    processes.append(subprocess.Popen(
+                        [sys.executable, '-m', 'gunicorn', *arguments,
+                         '--workers', str(options['workers']),
+                         '--bind', f'127.0.0.1:{port}'],
+                        cwd=settings.BASE_DIR,
+                        env={**os.environ, **SERVER_ENV.get(name, {})},
+                        stdout=subprocess.DEVNULL))
+                for base_url in targets.values():
+                    wait_for(base_url)
+            if not targets:
+                raise CommandError('Укажите --target или --serve')
+            report = {}
+            for name, base_url in targets.items():
+                self.stderr.write(f'Нагрузка на {name}: {base_url}')
+                report[name] = asyncio.run(load(base_url, options))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+        self.stdout.write(json.dumps({
+            'clients': options['clients'],
+            'requests_per_client': options['requests'],
+            'read_delay': options['read_delay'],
+            'targets': report,
+        }, ensure_ascii=False, indent=2))
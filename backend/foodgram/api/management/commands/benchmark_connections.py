@@ -0,0 +1,111 @@
+import json
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+# Режим -> (CONN_MAX_AGE, DB_CONN_HEALTH_CHECKS)
+MODES = {
+    'per-request': (0, False),
+    'persistent': (600, False),
+    'persistent-health-checks': (600, True),
+}
+
+
+def request_cycle(alias, sql):
+    """ Цикл запроса как в WSGIHandler: request_started закрывает
+        устаревшие соединения, запрос к БД, request_finished.
+    """
+    start = time.perf_counter()
+    request_started.send(sender=None)
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(sql)
+            cursor.fetchall()
+    finally:
+        request_finished.send(sender=None)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_mode(alias, mode, requests, threads, sql):
+    conn_max_age, health_checks = MODES[mode]
+    opened = []
+
+    def count(connection, **kwargs):
+        opened.append(connection.alias)
+
+    def worker(timings):
+        # У каждого потока своё соединение, как в воркере gthread
+        connection = connections[alias]
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        connection.close()
+        for _ in range(requests):
+            timings.append(request_cycle(alias, sql))
+        connection.close()
+
+    timings = []
+    connection_created.connect(count)
+    try:
+        with override_settings(DB_CONN_HEALTH_CHECKS=health_checks):
+            pool = [threading.Thread(target=worker, args=(timings,))
+                    for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        connection_created.disconnect(count)
+    timings.sort()
+    return {
+        'mode': mode,
+        'conn_max_age': conn_max_age,
+        'health_checks': health_checks,
+        'requests': len(timings),
+        'connections_opened': len(opened),
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'ms': {
+            'median': round(statistics.median(timings), 3),
+            'p95': round(timings[int(len(timings) * 0.95) - 1], 3),
+            'max': round(timings[-1], 3),
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает накладные расходы на соединения с БД: новое '
+            'соединение на каждый запрос, постоянные соединения '
+            'и постоянные соединения с проверкой')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Запросов в каждом потоке')
+        parser.add_argument('--threads', type=int, default=1)
+        parser.add_argument('--sql', default='SELECT 1')
+        parser.add_argument('--modes', nargs='*', choices=list(MODES),
+                            default=list(MODES))
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            report = [
+                run_mode(options['database'], mode, options['requests'],
+                         options['threads'], options['sql'])
+                for mode in options['modes']
+            ]
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        self.stdout.write(json.dumps({
+            'vendor': connection.vendor,
+            'pgbouncer': connection.settings_dict[
+                'DISABLE_SERVER_SIDE_CURSORS'],
+            'modes': report,
+        }, ensure_ascii=False, indent=2))
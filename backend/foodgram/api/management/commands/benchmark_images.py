@@ -0,0 +1,108 @@
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
+
+from api import images
+from app.models import Recipe
+
+User = get_user_model()
+
+FIELDS = ['image', *images.VARIANTS]
+
+
+def make_photo(rand, width, height):
+    """ JPEG с градиентом и шумом: сжимается примерно как фотография. """
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    draw = ImageDraw.Draw(image, 'RGBA')
+    for _ in range(30):
+        x, y = rand.randrange(width), rand.randrange(height)
+        radius = rand.randrange(50, width // 3)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=(rand.randrange(256), rand.randrange(256),
+                           rand.randrange(256), 160))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет объём изображений, которые загружает страница '
+            'списка рецептов, для оригиналов и миниатюр')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=6)
+        parser.add_argument('--width', type=int, default=1600)
+        parser.add_argument('--height', type=int, default=1200)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default=None,
+                            help='Файл для JSON-отчёта, иначе stdout')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
+                                   IMAGE_PROCESSING_WORKERS=0):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(content, encoding='utf-8')
+        else:
+            self.stdout.write(content)
+
+    def run(self, options):
+        rand = random.Random(options['seed'])
+        author = User.objects.create_user(
+            username='bench', email='bench@example.com', password='bench')
+        timings = []
+        for number in range(options['recipes']):
+            photo = make_photo(rand, options['width'], options['height'])
+            # Без пула варианты создаются в post_save этого же вызова.
+            start = time.perf_counter()
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10,
+                image=ContentFile(photo, name=f'photo{number}.jpg')
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+
+        response = APIClient().get('/api/recipes/',
+                                   {'limit': options['recipes']})
+        results = response.data['results']
+        totals = {
+            field: sum(default_storage.size(self.storage_name(recipe[field]))
+                       for recipe in results)
+            for field in FIELDS
+        }
+        return {
+            'recipes': len(results),
+            'source_size': f'{options["width"]}x{options["height"]}',
+            'json_bytes': len(response.content),
+            'image_bytes': totals,
+            'ratio': {
+                field: round(totals[field] / totals['image'], 3)
+                for field in images.VARIANTS
+            },
+            'save_with_variants_median_ms': round(
+                statistics.median(timings), 3),
+        }
+
+    @staticmethod
+    def storage_name(url):
+        return url.split(default_storage.base_url, 1)[-1]
@@ -0,0 +1,90 @@
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from .benchmark_api import INGREDIENTS_CSV, read_ingredients
+from app.models import Ingredient
+
+WORDS = ['молоко', 'сахар', 'картофель', 'говядина', 'соль']
+ENGINES = ['db', 'memory']
+
+
+def keystrokes(words):
+    for word in words:
+        for end in range(1, len(word) + 1):
+            yield word[:end]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку поиска ингредиентов на каждое нажатие '
+            'клавиши по полному каталогу во временной БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', default=str(INGREDIENTS_CSV),
+                            help='CSV-файл с ингредиентами')
+        parser.add_argument('--words', nargs='*', default=WORDS)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--engines', nargs='*', default=ENGINES,
+                            choices=ENGINES)
+        parser.add_argument('--output', default=None,
+                            help='Файл для JSON-отчёта, иначе stdout')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True)
+        try:
+            Ingredient.objects.bulk_create([
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in read_ingredients(
+                    Path(options['ingredients']))
+            ], ignore_conflicts=True)
+            report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        content = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(content, encoding='utf-8')
+        else:
+            self.stdout.write(content)
+
+    def run(self, options):
+        return {
+            'vendor': connection.vendor,
+            'ingredients': Ingredient.objects.count(),
+            'engines': {
+                engine: self.run_engine(engine, options)
+                for engine in options['engines']
+            },
+        }
+
+    def run_engine(self, engine, options):
+        client = APIClient()
+        rows = []
+        with override_settings(INGREDIENT_SEARCH_ENGINE=engine):
+            client.get('/api/ingredients/', {'name': 'а'})
+            for query in keystrokes(options['words']):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    response = client.get('/api/ingredients/',
+                                          {'name': query})
+                    timings.append((time.perf_counter() - start) * 1000)
+                rows.append({
+                    'query': query,
+                    'results': len(response.data),
+                    'median_ms': round(statistics.median(timings), 3),
+                    'max_ms': round(max(timings), 3),
+                })
+        medians = sorted(row['median_ms'] for row in rows)
+        return {
+            'keystrokes': rows,
+            'median_ms': statistics.median(medians),
+            'p95_ms': medians[int(len(medians) * 0.95) - 1],
+        }
@@ -0,0 +1,85 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import compiled
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeReadSerializer
+from app.models import Recipe
+
+User = get_user_model()
+
+
+def render_drf(user, start, stop):
+    request = Request(APIRequestFactory().get('/api/recipes/'))
+    request.user = user
+    recipes = Recipe.objects.for_read(user)[start:stop]
+    return JSONRenderer().render(RecipeReadSerializer(
+        recipes, many=True, context={'request': request}).data)
+
+
+def render_compiled(user, start, stop):
+    rows = compiled.rows(Recipe.objects.all(), user)[start:stop]
+    return FastJSONRenderer().render(compiled.serialize(rows, user))
+
+
+def median_ms(render, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def compare(users, pages, limit, repeat):
+    """ Сравнивает вывод обоих сериализаторов побайтно на первых
+        страницах ленты и замеряет время запросов, сериализации и рендера.
+    """
+    report = {'pages': [], 'mismatches': 0}
+    for user in users:
+        for page in range(pages):
+            start, stop = page * limit, (page + 1) * limit
+            expected = render_drf(user, start, stop)
+            actual = render_compiled(user, start, stop)
+            same = expected == actual
+            report['mismatches'] += not same
+            report['pages'].append({
+                'user': user.id,
+                'page': page + 1,
+                'bytes': len(expected),
+                'identical': same,
+                'drf_ms': median_ms(render_drf, repeat, user, start, stop),
+                'compiled_ms': median_ms(render_compiled, repeat,
+                                         user, start, stop),
+            })
+    return report
+
+
+class Command(BaseCommand):
+    help = ('Сверяет вывод компилированного сериализатора рецептов '
+            'с RecipeReadSerializer и замеряет время обоих')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', nargs='*', type=int, default=[],
+                            help='id пользователей, кроме анонимного')
+        parser.add_argument('--pages', type=int, default=3)
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        users = [AnonymousUser(), *User.objects.filter(
+            id__in=options['users'])]
+        report = compare(users, options['pages'], options['limit'],
+                         options['repeat'])
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        if report['mismatches']:
+            raise CommandError(
+                f'Вывод отличается на страницах: {report["mismatches"]}')
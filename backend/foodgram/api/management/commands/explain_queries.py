@@ -0,0 +1,147 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import compiled
+from api.filters import RecipeFilter
+from api.pagination import RecipePagination
+from api.views import SubscriptionViewSet
+from app.models import Ingredient, Recipe, RecipeSimilarity, Tag
+
+# Полное чтение таблицы в плане: таблица или её псевдоним
+SEQ_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)(?!.*\bUSING\b)'),
+}
+ALIAS = re.compile(r'"(\w+)" (\w+)')
+
+
+def user_request(user, params=None):
+    request = Request(APIRequestFactory().get('/', params or {}))
+    request.user = user
+    return request
+
+
+def recipe_queries(user):
+    """ Запросы ленты рецептов для всех фильтров и сортировок RecipeFilter
+        в том виде, в котором их строит RecipeViewSet.
+    """
+    if settings.COMPILED_RECIPE_SERIALIZER:
+        base = compiled.rows(Recipe.objects.all(), user)
+    else:
+        base = Recipe.objects.for_read(user)
+    author = Recipe.objects.values_list('author_id', flat=True).first()
+    tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+    filters = {
+        'recipes': {},
+        'recipes?author': {'author': author},
+        'recipes?tags': {'tags': tags},
+        'recipes?is_favorited=1': {'is_favorited': '1'},
+        'recipes?is_favorited=0': {'is_favorited': '0'},
+        'recipes?is_in_shopping_cart=1': {'is_in_shopping_cart': '1'},
+        'recipes?is_in_shopping_cart=0': {'is_in_shopping_cart': '0'},
+        'recipes?ordering=popular': {'ordering': 'popular'},
+    }
+    return {
+        name: RecipeFilter(params, queryset=base,
+                           request=user_request(user, params)).qs[
+            :RecipePagination.cursor_page_size]
+        for name, params in filters.items()
+    }
+
+
+def canonical_queries(user):
+    view = SubscriptionViewSet(request=user_request(user), format_kwarg=None)
+    return {
+        **recipe_queries(user),
+        'recipes/similar': RecipeSimilarity.objects.filter(
+            recipe_id=Recipe.objects.values_list('id', flat=True).first()
+        ).select_related('similar').order_by('-score'),
+        'subscriptions': view.get_queryset()[:10],
+        'subscribers': get_user_model().objects.filter(
+            follower__author=user).order_by('id')[:10],
+        'ingredients?name': Ingredient.objects.search(
+            'а', settings.INGREDIENT_SEARCH_LIMIT),
+        'shopping_list': user.shopping_list.select_related(
+            'ingredient').order_by('ingredient__name'),
+    }
+
+
+def table_rows(table):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class '
+                           'WHERE relname = %s', [table])
+        else:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def seq_scans(queryset, plan):
+    """ Таблицы, которые план читает целиком. """
+    pattern = SEQ_SCAN.get(connection.vendor)
+    if pattern is None:
+        return set()
+    aliases = dict((alias, table) for table, alias
+                   in ALIAS.findall(str(queryset.query)))
+    tables = {aliases.get(name, name) for name in pattern.findall(plan)}
+    return tables & set(connection.introspection.table_names())
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN ANALYZE для основных запросов API и '
+            'сообщает о полном чтении больших таблиц')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='id пользователя, по умолчанию тот, '
+                                 'у кого больше всего рецептов в избранном')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='С какого числа строк таблица считается '
+                                 'большой')
+        parser.add_argument('--plans', action='store_true',
+                            help='Вывести планы всех запросов')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options['user']:
+            user = users.get(id=options['user'])
+        else:
+            user = users.annotate(
+                favorites=Count('favorite_list')).order_by('-favorites')[0]
+        # SQLite не выполняет запрос при EXPLAIN, план только оценочный
+        explain = ({'analyze': True} if connection.vendor == 'postgresql'
+                   else {})
+        rows = {}
+        problems = []
+        for name, queryset in canonical_queries(user).items():
+            plan = queryset.explain(**explain)
+            large = []
+            for table in sorted(seq_scans(queryset, plan)):
+                if table not in rows:
+                    rows[table] = table_rows(table)
+                if rows[table] >= options['min_rows']:
+                    large.append(f'{table} ({rows[table]} строк)')
+            if options['plans'] or large:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(plan)
+            if large:
+                problems.append(name)
+                self.stdout.write(self.style.WARNING(
+                    f'Полное чтение: {", ".join(large)}'))
+            else:
+                self.stdout.write(f'{name}: OK')
+        if problems:
+            raise CommandError(
+                f'Полное чтение больших таблиц в запросах: '
+                f'{", ".join(problems)}')
+        self.stdout.write(self.style.SUCCESS(
+            'Большие таблицы читаются только по индексам'))
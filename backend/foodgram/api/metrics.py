@@ -0,0 +1,272 @@
+import asyncio
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import cache
+
+# Имя метрики -> (тип, описание, верхние границы корзин гистограммы)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Запросы к API по маршруту, методу и статусу', None),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)),
+    'foodgram_db_query_duration_seconds': (
+        'histogram', 'Время SQL-запросов',
+        (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+         math.inf)),
+    'foodgram_db_connections_total': (
+        'counter', 'Открытые соединения с БД', None),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшу ответов по группе и результату', None),
+}
+
+# Каждый поток пишет в свои словари без блокировок, блокировка нужна
+# только при появлении нового потока и при чтении списка словарей.
+_local = threading.local()
+_stores = []
+_stores_lock = threading.Lock()
+_started = time.time_ns()
+
+
+def _store():
+    store = getattr(_local, 'store', None)
+    if store is None:
+        store = _local.store = ({}, {})
+        with _stores_lock:
+            _stores.append(store)
+    return store
+
+
+def inc(name, labels, value=1):
+    counters = _store()[0]
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    """ Добавляет значение в гистограмму: счётчики корзин
+        (не накопительные) и сумма в последнем элементе.
+    """
+    histograms = _store()[1]
+    key = (name, labels)
+    buckets = METRICS[name][2]
+    row = histograms.get(key)
+    if row is None:
+        row = histograms[key] = [0] * (len(buckets) + 1)
+    row[bisect_left(buckets, value)] += 1
+    row[-1] += value
+
+
+def reset():
+    with _stores_lock:
+        for counters, histograms in _stores:
+            counters.clear()
+            histograms.clear()
+    cache.stats.clear()
+
+
+def merge(target, counters, histograms):
+    target_counters, target_histograms = target
+    for key, value in counters:
+        target_counters[key] += value
+    for key, row in histograms:
+        current = target_histograms.setdefault(key, [0] * len(row))
+        for index, value in enumerate(row):
+            current[index] += value
+
+
+def empty():
+    return defaultdict(float), {}
+
+
+def snapshot():
+    """ Метрики этого процесса. """
+    result = empty()
+    with _stores_lock:
+        stores = list(_stores)
+    for counters, histograms in stores:
+        merge(result, dict(counters).items(),
+              [(key, list(row)) for key, row in dict(histograms).items()])
+    merge(result, [
+        (('foodgram_cache_requests_total',
+          (('group', key.rsplit(':', 1)[0]),
+           ('result', key.rsplit(':', 1)[1]))), count)
+        for key, count in dict(cache.stats).items()
+    ], [])
+    return result
+
+
+def process_file():
+    return Path(settings.METRICS_DIR) / f'{os.getpid()}-{_started}.json'
+
+
+def flush():
+    """ Записывает метрики процесса в METRICS_DIR. Файл заменяется
+        атомарно, файлы завершившихся процессов остаются, чтобы
+        счётчики не уменьшались.
+    """
+    if not settings.METRICS_DIR:
+        return
+    counters, histograms = snapshot()
+    path = process_file()
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps({
+        'counters': [[name, labels, value]
+                     for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, row]
+                       for (name, labels), row in histograms.items()],
+    }))
+    os.replace(temporary, path)
+
+
+def collect():
+    """ Метрики всех процессов, записавших файлы в METRICS_DIR,
+        или только этого процесса, если каталог не задан.
+    """
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush()
+    result = empty()
+    for path in Path(settings.METRICS_DIR).glob('*.json'):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        merge(result, [
+            ((name, tuple(map(tuple, labels))), value)
+            for name, labels, value in data['counters']
+        ], [
+            ((name, tuple(map(tuple, labels))), row)
+            for name, labels, row in data['histograms']
+        ])
+    return result
+
+
+def format_labels(labels):
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+    return f'{{{pairs}}}' if pairs else ''
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(metrics):
+    """ Метрики в текстовом формате Prometheus. """
+    counters, histograms = metrics
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            lines += [
+                f'{name}{format_labels(labels)} {format_value(value)}'
+                for (metric, labels), value in sorted(counters.items())
+                if metric == name
+            ]
+            continue
+        for (metric, labels), row in sorted(histograms.items()):
+            if metric != name:
+                continue
+            total = 0
+            for bound, count in zip(buckets, row):
+                total += count
+                bucket_labels = labels + (('le', format_value(bound)),)
+                lines.append(f'{name}_bucket{format_labels(bucket_labels)} '
+                             f'{total}')
+            lines += [
+                f'{name}_sum{format_labels(labels)} {format_value(row[-1])}',
+                f'{name}_count{format_labels(labels)} {total}',
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+def route(request):
+    match = request.resolver_match
+    return match.view_name if match else 'unresolved'
+
+
+def observe_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        observe('foodgram_db_query_duration_seconds',
+                (('alias', context['connection'].alias),),
+                time.perf_counter() - start)
+
+
+# Время SQL-запросов замеряется обёрткой самого соединения: запрос
+# к БД может выполняться не в потоке middleware (пул async-представлений,
+# потоки миниатюр).
+@receiver(connection_created)
+def count_connection(connection, **kwargs):
+    if not settings.METRICS_ENABLED:
+        return
+    inc('foodgram_db_connections_total', (('alias', connection.alias),))
+    if observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_query)
+
+
+class MetricsMiddleware:
+    """ Считает запросы и их время по маршрутам, в WSGI и в ASGI.
+        При заданном METRICS_DIR раз в METRICS_FLUSH_INTERVAL секунд
+        сбрасывает метрики процесса в файл для /metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.flushed = time.monotonic()
+        if settings.METRICS_DIR:
+            Path(settings.METRICS_DIR).mkdir(parents=True, exist_ok=True)
+            atexit.unregister(flush)
+            atexit.register(flush)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, start)
+        return response
+
+    def record(self, request, response, start):
+        labels = (('route', route(request)), ('method', request.method))
+        observe('foodgram_http_request_duration_seconds', labels,
+                time.perf_counter() - start)
+        inc('foodgram_http_requests_total',
+            labels + (('status', str(response.status_code)),))
+        now = time.monotonic()
+        if settings.METRICS_DIR and (
+                now - self.flushed >= settings.METRICS_FLUSH_INTERVAL):
+            self.flushed = now
+            flush()
@@ -1,4 +1,8 @@
-from rest_framework import viewsets
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import status, viewsets
+
+from . import cache
+from .flags import UserFlags
 
 
 class ListRetrieveViewSet(viewsets.mixins.ListModelMixin,
@@ -10,3 +14,46 @@ class ListRetrieveViewSet(viewsets.mixins.ListModelMixin,
 class ListViewSet(viewsets.mixins.ListModelMixin,
                   viewsets.GenericViewSet):
     pass
+
+
+class UserFlagsMixin:
+    """ Передаёт сериализаторам общий для запроса UserFlags. """
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(),
+                'user_flags': UserFlags(self.request.user)}
+
+
+class CachedResponseMixin:
+    """ Кэширует отрендеренные ответы list и retrieve для справочных
+        данных и отвечает 304 на If-None-Match с актуальным ETag.
+    """
+    cache_group = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cached = cache.get_response(self.cache_group, request)
+        hit = cached is not None
+        if not hit:
+            response = self.finalize_response(
+                request, handler(request, *args, **kwargs), *args, **kwargs)
+            response.render()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cached = cache.set_response(self.cache_group, request,
+                                        response.content,
+                                        response['Content-Type'])
+        etag, content, content_type = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
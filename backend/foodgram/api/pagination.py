@@ -1,5 +1,125 @@
+import base64
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import and_, or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class RecipePagination(pagination.PageNumberPagination):
+    """ Постраничная пагинация page/limit. С параметром cursor включается
+        пагинация по ключу: без COUNT(*) и OFFSET, следующая страница
+        выбирается условием на значения ключа последнего объекта текущей.
+        Ключом служит явная сортировка выборки, иначе keyset_ordering.
+    """
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    cursor_page_size = 6
+    keyset_ordering = ('-pub_date', '-id')
+
+    def __init__(self):
+        self.ordering = self.keyset_ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        size = self.get_page_size(request) or self.cursor_page_size
+        self.ordering = tuple(queryset.query.order_by) or self.keyset_ordering
+        reverse, values = self.decode_cursor(
+            request.query_params[self.cursor_query_param])
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        try:
+            if values is not None:
+                queryset = queryset.filter(
+                    self.keyset_filter(ordering, values))
+            page = list(queryset[:size + 1])
+        except (ValidationError, ValueError):
+            raise NotFound('Неверный курсор')
+        has_more = len(page) > size
+        page = page[:size]
+        if reverse:
+            page.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        self.next_cursor = self.previous_cursor = None
+        if page and has_next:
+            self.next_cursor = self.encode_cursor(page[-1], False)
+        if page and has_previous:
+            self.previous_cursor = self.encode_cursor(page[0], True)
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_cursor_link(self.next_cursor)),
+            ('previous', self.get_cursor_link(self.previous_cursor)),
+            ('results', data),
+        ]))
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def keyset_filter(ordering, values):
+        """ (a, b) после (x, y) при сортировке по убыванию:
+            a <= x AND (a < x OR (a = x AND b < y)).
+            Первое условие позволяет БД сканировать индекс по диапазону.
+        """
+        conditions = []
+        for position, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = [Q(**{prev.lstrip('-'): value}) for prev, value
+                     in zip(ordering[:position], values)]
+            conditions.append(reduce(
+                and_, equal, Q(**{f'{name}__{lookup}': values[position]})))
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & reduce(
+            or_, conditions)
+
+    def encode_cursor(self, obj, reverse):
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(obj, dict):
+            values = [str(obj[name]) for name in names]
+        else:
+            values = [str(getattr(obj, name)) for name in names]
+        return base64.urlsafe_b64encode(
+            json.dumps([reverse, *values]).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return False, None
+        try:
+            reverse, *values = json.loads(base64.urlsafe_b64decode(cursor))
+        except (TypeError, ValueError):
+            raise NotFound('Неверный курсор')
+        if len(values) != len(self.ordering):
+            raise NotFound('Неверный курсор')
+        return bool(reverse), values
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+
+class SubscriptionPagination(RecipePagination):
+    keyset_ordering = ('id',)
@@ -14,3 +14,9 @@ class ReadOnly(BasePermission):
     """Права для ингридиентов и тэгов"""
     def has_permission(self, request, view):
         return request.method in SAFE_METHODS
+
+
+class IsAdmin(BasePermission):
+    """Права администратора"""
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_admin
@@ -0,0 +1,269 @@
+import hmac
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограмм: миллисекунды и число запросов
+TIME_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000,
+                10000, math.inf)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, math.inf)
+METRICS = {
+    'total': TIME_BUCKETS,
+    'db': TIME_BUCKETS,
+    'serialize': TIME_BUCKETS,
+    'render': TIME_BUCKETS,
+    'queries': COUNT_BUCKETS,
+}
+PERCENTILES = (50, 90, 99)
+# Сколько повторяющихся запросов маршрута хранить
+TOP_DUPLICATES = 5
+
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+_current = ContextVar('profile', default=None)
+
+
+@contextmanager
+def track_queries():
+    """ Подключает профиль текущего запроса к соединениям потока,
+        в котором выполняется код: обёртка execute_wrapper действует
+        только в потоке, где её установили, а контекст запроса
+        переходит в потоки пула вместе с _current.
+    """
+    profile = _current.get()
+    with ExitStack() as stack:
+        if profile is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(profile))
+        yield
+
+
+def fingerprint(sql):
+    """ Текст запроса без числа параметров в IN (...): запросы,
+        отличающиеся только значениями, совпадают.
+    """
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class Profile:
+    """ Замеры одного запроса: время и число SQL-запросов, отпечатки
+        запросов и участки кода, отмеченные span().
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.fingerprints = Counter()
+        self.spans = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.spans['db'] += (time.perf_counter() - start) * 1000
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def finish(self):
+        self.spans['total'] = (time.perf_counter() - self.started) * 1000
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items()
+                if count >= settings.PROFILING_DUPLICATE_THRESHOLD}
+
+    def metrics(self):
+        return {**{name: self.spans[name] for name in METRICS
+                   if name != 'queries'},
+                'queries': self.queries}
+
+    def server_timing(self):
+        timings = [
+            f'db;dur={self.spans["db"]:.1f};desc="{self.queries} queries"'
+        ]
+        timings += [f'{name};dur={self.spans[name]:.1f}'
+                    for name in sorted(self.spans)
+                    if name not in ('db', 'total')]
+        duplicates = self.duplicates()
+        if duplicates:
+            timings.append(
+                f'dup;desc="{sum(duplicates.values())} repeated queries"')
+        timings.append(f'total;dur={self.spans["total"]:.1f}')
+        return ', '.join(timings)
+
+
+@contextmanager
+def span(name):
+    """ Добавляет время участка кода в профиль текущего запроса.
+        Вне профилируемого запроса ничего не делает.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.spans[name] += (time.perf_counter() - start) * 1000
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def add(self, value):
+        index = next(index for index, bound in enumerate(self.buckets)
+                     if value <= bound)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """ Верхняя граница корзины, в которую попал перцентиль. """
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def table(self):
+        return {
+            **{f'p{percent}': round(float(self.percentile(percent)), 1)
+               for percent in PERCENTILES},
+            'mean': round(self.sum / self.count, 1) if self.count else 0,
+            'max': round(self.max, 1),
+        }
+
+
+class RouteStats:
+    def __init__(self):
+        self.histograms = {name: Histogram(buckets)
+                           for name, buckets in METRICS.items()}
+        self.requests = 0
+        self.with_duplicates = 0
+        self.duplicates = Counter()
+
+    def add(self, profile):
+        self.requests += 1
+        for name, value in profile.metrics().items():
+            self.histograms[name].add(value)
+        duplicates = profile.duplicates()
+        if duplicates:
+            self.with_duplicates += 1
+            self.duplicates.update(duplicates)
+
+    def table(self):
+        return {
+            'requests': self.requests,
+            'with_duplicates': self.with_duplicates,
+            **{name: histogram.table()
+               for name, histogram in self.histograms.items()},
+            'duplicates': [
+                {'sql': sql, 'count': count}
+                for sql, count in self.duplicates.most_common(TOP_DUPLICATES)
+            ],
+        }
+
+
+class Registry:
+    """ Гистограммы по маршрутам в памяти процесса. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def add(self, route, profile):
+        with self.lock:
+            self.routes.setdefault(route, RouteStats()).add(profile)
+
+    def table(self):
+        with self.lock:
+            return {route: stats.table()
+                    for route, stats in sorted(self.routes.items())}
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+registry = Registry()
+
+
+def route(request):
+    match = request.resolver_match
+    return f'{request.method} {match.view_name if match else "unresolved"}'
+
+
+def requested(request):
+    """ При PROFILING = 'header' профилируются только запросы, у которых
+        заголовок X-Profile совпадает с PROFILING_SECRET: Server-Timing
+        и гистограммы раскрывают устройство запросов к БД. Без секрета
+        профилирование по заголовку выключено.
+    """
+    if settings.PROFILING == 'on':
+        return True
+    secret = settings.PROFILING_SECRET
+    return bool(secret) and hmac.compare_digest(
+        request.META.get('HTTP_X_PROFILE', '').encode(), secret.encode())
+
+
+class ProfilingMiddleware:
+    """ Профилирует запросы при PROFILING = 'on' или, при
+        PROFILING = 'header', запросы с секретом в заголовке X-Profile.
+        Замеры уходят в заголовок Server-Timing и в гистограммы
+        маршрута, повторяющиеся запросы (N+1) пишутся в лог.
+    """
+
+    def __init__(self, get_response):
+        if settings.PROFILING not in ('on', 'header'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not requested(request):
+            return self.get_response(request)
+        profile = Profile()
+        token = _current.set(profile)
+        try:
+            with track_queries():
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        profile.finish()
+        response['Server-Timing'] = profile.server_timing()
+        registry.add(route(request), profile)
+        duplicates = profile.duplicates()
+        if duplicates:
+            logger.warning('Повторяющиеся запросы в %s: %s', route(request),
+                           duplicates)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = _current.get()
+        if profile is None:
+            return response
+        start = time.perf_counter()
+
+        def rendered(response):
+            profile.spans['render'] += (time.perf_counter() - start) * 1000
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,157 @@
+import heapq
+import math
+import time
+from array import array
+from collections import defaultdict
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from app.models import Recipe, RecipeSimilarity
+
+User = get_user_model()
+
+TOP_K = 10
+CART_WEIGHT = 0.5
+MAX_USER_ITEMS = 500
+BATCH_SIZE = 1000
+CHUNK_SIZE = 10000
+
+
+def links(through, weight):
+    """ Строки (user_id, recipe_id, вес) промежуточной таблицы
+        в порядке пользователей.
+    """
+    return (
+        (user_id, recipe_id, weight)
+        for user_id, recipe_id in through.objects.order_by(
+            'user_id', 'recipe_id'
+        ).values_list('user_id', 'recipe_id').iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+class Interactions:
+    """ Разреженная матрица пользователь × рецепт в формате CSR и она же
+        по столбцам, на массивах array: память линейна по числу связей,
+        а не по произведению пользователей на рецепты. Вес связи — сумма
+        весов избранного и корзины. Пользователи, у которых больше
+        max_user_items рецептов, пропускаются: они почти не различают
+        рецепты, а стоимость расчёта растёт как квадрат их числа.
+    """
+
+    def __init__(self, streams, max_user_items):
+        self.user_ptr = array('q', [0])
+        self.items = array('q')
+        self.weights = array('d')
+        self.skipped_users = 0
+        for _, rows in groupby(heapq.merge(*streams), key=itemgetter(0)):
+            row = defaultdict(float)
+            for _, recipe_id, weight in rows:
+                row[recipe_id] += weight
+            if len(row) > max_user_items:
+                self.skipped_users += 1
+                continue
+            self.items.extend(row.keys())
+            self.weights.extend(row.values())
+            self.user_ptr.append(len(self.items))
+        self.transpose()
+
+    @property
+    def users(self):
+        return len(self.user_ptr) - 1
+
+    def transpose(self):
+        """ Столбцы матрицы: пользователи каждого рецепта с весами
+            и нормы столбцов для косинусного сходства.
+        """
+        size = max(self.items, default=0) + 1
+        self.item_ptr = array('q', [0]) * (size + 1)
+        for item in self.items:
+            self.item_ptr[item + 1] += 1
+        for item in range(size):
+            self.item_ptr[item + 1] += self.item_ptr[item]
+        self.item_users = array('q', [0]) * len(self.items)
+        self.item_weights = array('d', [0]) * len(self.items)
+        fill = array('q', self.item_ptr)
+        self.norms = array('d', [0]) * size
+        for user in range(self.users):
+            start, end = self.user_ptr[user], self.user_ptr[user + 1]
+            for item, weight in zip(self.items[start:end],
+                                    self.weights[start:end]):
+                self.item_users[fill[item]] = user
+                self.item_weights[fill[item]] = weight
+                fill[item] += 1
+                self.norms[item] += weight * weight
+        self.norms = array('d', map(math.sqrt, self.norms))
+
+    def neighbors(self, item, top_k):
+        """ top_k рецептов, ближайших к item по косинусу столбцов.
+            Скалярные произведения со всеми рецептами считаются за один
+            проход по пользователям рецепта, память — один словарь.
+        """
+        if item >= len(self.norms) or not self.norms[item]:
+            return []
+        scores = defaultdict(float)
+        for pos in range(self.item_ptr[item], self.item_ptr[item + 1]):
+            user, weight = self.item_users[pos], self.item_weights[pos]
+            start, end = self.user_ptr[user], self.user_ptr[user + 1]
+            for other, other_weight in zip(self.items[start:end],
+                                           self.weights[start:end]):
+                scores[other] += weight * other_weight
+        scores.pop(item, None)
+        norm = self.norms[item]
+        return heapq.nlargest(top_k, (
+            (score / (norm * self.norms[other]), other)
+            for other, score in scores.items()
+        ))
+
+
+def save_batch(matrix, recipe_ids, top_k):
+    """ Заменяет соседей рецептов пачки. Рецепты, удалённые после
+        чтения матрицы, не сохраняются.
+    """
+    neighbors = {recipe_id: matrix.neighbors(recipe_id, top_k)
+                 for recipe_id in recipe_ids}
+    with transaction.atomic():
+        existing = set(Recipe.objects.filter(id__in={
+            other for found in neighbors.values() for _, other in found
+        } | set(recipe_ids)).values_list('id', flat=True))
+        RecipeSimilarity.objects.filter(recipe_id__in=recipe_ids).delete()
+        rows = RecipeSimilarity.objects.bulk_create([
+            RecipeSimilarity(recipe_id=recipe_id, similar_id=other,
+                             score=score)
+            for recipe_id, found in neighbors.items()
+            if recipe_id in existing
+            for score, other in found if other in existing
+        ])
+    return len(rows)
+
+
+def build(top_k=TOP_K, cart_weight=CART_WEIGHT,
+          max_user_items=MAX_USER_ITEMS, batch_size=BATCH_SIZE,
+          progress=None):
+    """ Строит таблицу похожих рецептов: top_k соседей каждого рецепта
+        по косинусному сходству столбцов матрицы избранного и корзин.
+        Рецепты обрабатываются пачками по batch_size, соседи пачки
+        заменяются в одной транзакции, так что таблица всё время
+        доступна для чтения.
+    """
+    start = time.perf_counter()
+    matrix = Interactions([
+        links(User.favorite_list.through, 1.0),
+        links(User.cart.through, cart_weight),
+    ], max_user_items)
+    recipe_ids = iter(array('q', Recipe.objects.order_by('id').values_list(
+        'id', flat=True).iterator(chunk_size=CHUNK_SIZE)))
+    report = {'users': matrix.users,
+              'skipped_users': matrix.skipped_users,
+              'links': len(matrix.items), 'recipes': 0, 'rows': 0}
+    for batch in iter(lambda: list(islice(recipe_ids, batch_size)), []):
+        report['rows'] += save_batch(matrix, batch, top_k)
+        report['recipes'] += len(batch)
+        if progress:
+            progress(report)
+    report['seconds'] = round(time.perf_counter() - start, 2)
+    return report
@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """ JSONRenderer на orjson, если он установлен. Вывод совпадает
+        с JSONRenderer побайтно, кроме записи экспоненты и NaN у float.
+        Даты и прочие нестандартные типы кодирует энкодер DRF.
+    """
+    options = (orjson.OPT_NON_STR_KEYS
+               | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+    default = encoders.JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default,
+                               option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029')
+
+
+class ShoppingCartRenderer(renderers.BaseRenderer):
+    """ Базовый рендерер списка покупок.
+        Строки списка отдаются генератором stream(). Ответы с ошибками
+        RecipeViewSet рендерит в JSON, render() — запасной вариант для
+        рендерера без кодировки (PDF).
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    def stream(self, ingredients):
+        raise NotImplementedError
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for ing in ingredients:
+            yield (f'{ing["ingredient__name"]}: '
+                   f'{ing["sum_amount"]} '
+                   f'{ing["ingredient__measurement_unit"]}\n')
+
+
+class Echo:
+    """ Псевдобуфер для csv.writer: возвращает записанную строку. """
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('Ингредиент', 'Количество', 'Единица'))
+        for ing in ingredients:
+            yield writer.writerow((ing['ingredient__name'],
+                                   ing['sum_amount'],
+                                   ing['ingredient__measurement_unit']))
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    """ PDF нельзя отдавать по частям: таблица ссылок записывается
+        в конце файла, поэтому документ собирается целиком.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+    line_height = 18
+    margin = 50
+
+    def stream(self, ingredients):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT))
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        height = A4[1]
+        y = height - self.margin
+        pdf.setFont(self.font_name, self.font_size)
+        for line in ShoppingCartTextRenderer().stream(ingredients):
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(self.font_name, self.font_size)
+                y = height - self.margin
+            pdf.drawString(self.margin, y, line.rstrip('\n'))
+            y -= self.line_height
+        pdf.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_CART_RENDERERS = [ShoppingCartTextRenderer, ShoppingCartCSVRenderer]
+if canvas is not None:
+    SHOPPING_CART_RENDERERS.append(ShoppingCartPDFRenderer)
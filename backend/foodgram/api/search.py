@@ -0,0 +1,75 @@
+import threading
+import time
+from bisect import bisect_left
+from itertools import islice
+
+from django.conf import settings
+
+from app.models import Ingredient
+
+
+class IngredientIndex:
+    """ Отсортированный по названию каталог ингредиентов в памяти.
+        Совпадения с начала названия ищутся бинарным поиском,
+        остальные совпадения по подстроке добираются проходом по списку.
+    """
+
+    def __init__(self, ingredients):
+        self.by_id = sorted(ingredients, key=lambda item: item['id'])
+        self.items = sorted(
+            self.by_id, key=lambda item: (item['name'].casefold(), item['id'])
+        )
+        self.keys = [item['name'].casefold() for item in self.items]
+        self.built_at = time.monotonic()
+
+    def all(self):
+        return self.by_id
+
+    def search(self, name, limit=None):
+        name = name.casefold()
+        start = bisect_left(self.keys, name)
+        end = bisect_left(self.keys, name + '\U0010ffff', start)
+        found = self.items[start:end][:limit]
+        if limit and len(found) >= limit:
+            return found
+        rest = (item for key, item in zip(self.keys, self.items)
+                if name in key and not key.startswith(name))
+        if limit:
+            rest = islice(rest, limit - len(found))
+        found.extend(rest)
+        return found
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return settings.INGREDIENT_SEARCH_ENGINE == 'memory'
+
+
+def expired(index):
+    return (index is None or time.monotonic() - index.built_at
+            > settings.INGREDIENT_SEARCH_INDEX_TTL)
+
+
+def get_index():
+    """ Возвращает индекс, при необходимости перестраивая его.
+        Индекс живёт в памяти процесса, поэтому изменения из других
+        процессов подхватываются не позже чем через
+        INGREDIENT_SEARCH_INDEX_TTL секунд.
+    """
+    global _index
+    index = _index
+    if expired(index):
+        with _lock:
+            index = _index
+            if expired(index):
+                index = _index = IngredientIndex(Ingredient.objects.values(
+                    'id', 'name', 'measurement_unit'))
+    return index
+
+
+def invalidate():
+    global _index
+    _index = None
@@ -1,13 +1,38 @@
 from django.contrib.auth import get_user_model, hashers, password_validation
+from django.db import models, transaction
 from rest_framework import serializers
 
-from .fields import Base64ImageField
-from .utils import add_ingredients
-from app.models import Ingredient, Recipe, RecipeIngredient, Tag
+from .fields import (Base64ImageField, ImageVariantField, ImportImageField,
+                     PrimaryKeyListField)
+from .flags import UserFlags
+from .utils import (add_ingredients, get_recipes_limit, update_ingredients,
+                    update_shopping_lists)
+from app.models import (Ingredient, Recipe, RecipeIngredient, ShoppingListItem,
+                        Tag)
 
 User = get_user_model()
 
 
+def user_flags(context):
+    """ UserFlags запроса из контекста. Если представление его не
+        передало, он создаётся и живёт в контексте сериализатора.
+    """
+    flags = context.get('user_flags')
+    if flags is None:
+        flags = context['user_flags'] = UserFlags(context['request'].user)
+    return flags
+
+
+class UserFlagsListSerializer(serializers.ListSerializer):
+    """ Загружает флаги пользователя для всей страницы до вывода. """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager)
+                     else data)
+        self.child.load_flags(items)
+        return super().to_representation(items)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """ Сериализатор для работы с пользователями. """
     is_subscribed = serializers.SerializerMethodField()
@@ -16,12 +41,16 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed')
+        list_serializer_class = UserFlagsListSerializer
+
+    def load_flags(self, users):
+        user_flags(self.context).load(author_ids=[
+            user.id for user in users if not hasattr(user, 'is_subscribed')])
 
     def get_is_subscribed(self, obj):
-        if self.context['request'].user.is_authenticated:
-            request_user = self.context['request'].user
-            return obj.following.filter(user=request_user).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return user_flags(self.context).is_subscribed(obj.id)
 
 
 class UserSignUpSerializer(serializers.ModelSerializer):
@@ -73,10 +102,13 @@ class RecipeSubSerializer(serializers.ModelSerializer):
         списка подписок.
     """
     image = serializers.SerializerMethodField(read_only=True)
+    thumbnail = ImageVariantField('thumbnail')
+    thumbnail_webp = ImageVariantField('thumbnail_webp')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnail', 'thumbnail_webp',
+                  'cooking_time')
 
     def get_image(self, obj):
         return obj.image.url
@@ -85,9 +117,9 @@ class RecipeSubSerializer(serializers.ModelSerializer):
 class IngredientInRecipeCreateSerializer(serializers.ModelSerializer):
     """ Сериализатор для работы с ингредиентами при создании рецепта. """
     recipe = serializers.PrimaryKeyRelatedField(read_only=True)
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    # Ингредиенты всего рецепта ищутся одним запросом
+    # в RecipeSerializer.validate_ingredients.
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -115,6 +147,13 @@ class IngredientRecSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
+class ShoppingListSerializer(IngredientRecSerializer):
+    """ Сериализатор для строк списка покупок. """
+
+    class Meta(IngredientRecSerializer.Meta):
+        model = ShoppingListItem
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """ Сериализатор для чтения рецептов. """
     is_favorited = serializers.SerializerMethodField(read_only=True)
@@ -124,94 +163,183 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     ingredients = IngredientRecSerializer(read_only=True, many=True,
                                           source='recipe_ing')
     image = serializers.SerializerMethodField(read_only=True)
+    thumbnail = ImageVariantField('thumbnail')
+    thumbnail_webp = ImageVariantField('thumbnail_webp')
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'thumbnail',
+                  'thumbnail_webp', 'text', 'cooking_time')
+        list_serializer_class = UserFlagsListSerializer
+
+    def load_flags(self, recipes):
+        user_flags(self.context).load(
+            recipe_ids=[recipe.id for recipe in recipes
+                        if not hasattr(recipe, 'is_favorited')],
+            author_ids=[recipe.author_id for recipe in recipes
+                        if not hasattr(recipe.author, 'is_subscribed')])
 
     def get_image(self, obj):
         return obj.image.url
 
     def get_is_favorited(self, obj):
-        if self.context['request'].user.is_authenticated:
-            return obj.user_favorite.filter(
-                username=self.context['request'].user.username).exists()
-        return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return user_flags(self.context).is_favorited(obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        if self.context['request'].user.is_authenticated:
-            return obj.user_cart.filter(
-                username=self.context['request'].user.username).exists()
-        return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return user_flags(self.context).is_in_shopping_cart(obj.id)
 
 
 class RecipeSerializer(RecipeReadSerializer):
     """ Сериализатор для записи рецептов. """
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                              many=True)
+    tags = PrimaryKeyListField(queryset=Tag.objects.all())
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeCreateSerializer(many=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'thumbnail',
+                  'thumbnail_webp', 'text', 'cooking_time')
 
     def validate_ingredients(self, ingredients):
-        unique_ing = []
-        for ingredient in ingredients:
-            if ingredient['id'] not in unique_ing:
-                unique_ing.append(ingredient['id'])
-            else:
-                raise serializers.ValidationError(
-                    'Нельзя добавлять ингредиент дважды'
-                )
-        if not unique_ing:
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if not ids:
             raise serializers.ValidationError(
                 'Нужно добавить хотя бы один ингредиент'
             )
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Нельзя добавлять ингредиент дважды'
+            )
+        found = Ingredient.objects.in_bulk(ids)
+        for ingredient in ingredients:
+            if ingredient['id'] not in found:
+                raise serializers.ValidationError(
+                    f'Недопустимый первичный ключ "{ingredient["id"]}" - '
+                    'объект не существует.'
+                )
+            ingredient['id'] = found[ingredient['id']]
         return ingredients
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            recipe.tags.add(tag)
+        recipe.tags.set(tags)
         add_ingredients(recipe, ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        if 'image' in validated_data:
+            # Старые миниатюры не подходят к новому изображению.
+            validated_data.update(thumbnail='', thumbnail_webp='')
         super().update(recipe, validated_data)
-        recipe.tags.clear()
-        for tag in tags:
-            recipe.tags.add(tag)
-        recipe.recipe_ing.all().delete()
-        add_ingredients(recipe, ingredients)
+        recipe.tags.set(tags)
+        old_amounts = update_ingredients(recipe, ingredients)
+        update_shopping_lists(recipe, old_amounts, ingredients)
         return recipe
 
 
+class IngredientImportSerializer(IngredientInRecipeCreateSerializer):
+    """ Ингредиент строки импорта: название и единица измерения
+        вместо id, которые в разных окружениях не совпадают.
+    """
+    recipe = None
+    id = None
+    name = serializers.CharField()
+    measurement_unit = serializers.CharField()
+
+    class Meta(IngredientInRecipeCreateSerializer.Meta):
+        fields = ('name', 'measurement_unit', 'amount')
+
+
+class RecipeImportSerializer(RecipeSerializer):
+    """ Сериализатор строки импорта рецептов с правилами RecipeSerializer.
+        Теги задаются slug, автор — email, изображение — именем файла.
+        Справочники загружаются один раз на пачку строк и передаются
+        в context: tags, ingredients, authors, author (автор по умолчанию)
+        и open_image.
+    """
+    tags = serializers.ListField(child=serializers.CharField())
+    author = serializers.EmailField(required=False)
+    ingredients = IngredientImportSerializer(many=True)
+    image = ImportImageField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = ('tags', 'author', 'ingredients', 'name', 'image', 'text',
+                  'cooking_time')
+
+    def validate_tags(self, slugs):
+        found = self.context['tags']
+        for slug in slugs:
+            if slug not in found:
+                raise serializers.ValidationError(
+                    f'Тег "{slug}" не существует.')
+        return [found[slug] for slug in dict.fromkeys(slugs)]
+
+    def validate_author(self, email):
+        author = self.context['authors'].get(email)
+        if author is None:
+            raise serializers.ValidationError(
+                f'Пользователь "{email}" не существует.')
+        return author
+
+    def validate_ingredients(self, ingredients):
+        keys = [(item['name'], item['measurement_unit'])
+                for item in ingredients]
+        if not keys:
+            raise serializers.ValidationError(
+                'Нужно добавить хотя бы один ингредиент'
+            )
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError(
+                'Нельзя добавлять ингредиент дважды'
+            )
+        found = self.context['ingredients']
+        for key, ingredient in zip(keys, ingredients):
+            if key not in found:
+                raise serializers.ValidationError(
+                    f'Ингредиент "{key[0]}, {key[1]}" не существует.')
+            ingredient['id'] = found[key]
+        return ingredients
+
+    def validate(self, attrs):
+        attrs.setdefault('author', self.context['author'])
+        if attrs['author'] is None:
+            raise serializers.ValidationError(
+                {'author': 'Не указан автор рецепта.'})
+        return attrs
+
+
 class UserSubSerializer(UserSerializer):
     """ Сериализатор для работы с пользователями при выводе списка подписок """
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
-    class Meta:
-        model = User
+    class Meta(UserSerializer.Meta):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes_count(self, obj):
-        return obj.recipes.all().count()
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
 
     def get_recipes(self, obj):
-        recipes = obj.recipes.filter()[:3]
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            limit = get_recipes_limit(self.context['request'])
+            recipes = obj.recipes.all()[:limit]
         return RecipeSubSerializer(recipes, many=True).data
 
 
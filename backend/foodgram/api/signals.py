@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, cache, images, search
+from app.models import Ingredient, Recipe, ShoppingListItem, Subscription, Tag
+
+User = get_user_model()
+
+
+def bump_on_commit(group):
+    transaction.on_commit(lambda: cache.bump_version(group))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    transaction.on_commit(search.invalidate)
+    bump_on_commit('ingredients')
+    # Лента рецептов содержит названия и единицы ингредиентов
+    bump_on_commit('recipes')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tag_cache(**kwargs):
+    bump_on_commit('tags')
+    bump_on_commit('recipes')
+
+
+# Ингредиенты и теги рецепта меняются в одной транзакции с самим
+# рецептом, поколение сбрасывается после её коммита.
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_feed(**kwargs):
+    bump_on_commit('recipes')
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, update_fields=None, **kwargs):
+    if update_fields and 'image' not in update_fields:
+        return
+    images.schedule(instance.id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_recipe_feed_authors(update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    bump_on_commit('recipes')
+
+
+# Выход (djoser удаляет токен) и удаление пользователя каскадом
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    # key — первичный ключ токена, после удаления он равен None
+    key = instance.key
+    transaction.on_commit(lambda: authentication.invalidate(key))
+
+
+# Смена пароля, роли и деактивация сохраняют пользователя: закэшированный
+# вместе с токеном объект пользователя больше не актуален.
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list(
+        'key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: authentication.invalidate(*keys))
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def invalidate_user_flags(instance, **kwargs):
+    bump_on_commit(cache.user_group(instance.user_id))
+
+
+# Для автоматических промежуточных моделей post_save не отправляется,
+# прямые записи в них (add_to_list) сбрасывают поколение сами.
+@receiver(m2m_changed, sender=User.favorite_list.through)
+@receiver(m2m_changed, sender=User.cart.through)
+def invalidate_user_flags_m2m(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    user_ids = (pk_set or ()) if reverse else [instance.pk]
+    for user_id in user_ids:
+        bump_on_commit(cache.user_group(user_id))
+
+
+def changed_links(sender, instance, reverse, pk_set):
+    """ Связи пользователь-рецепт, затронутые изменением ManyToMany.
+        Для post_add в pk_set только действительно добавленные связи,
+        удаляемые связи нужно выбирать до удаления.
+    """
+    source, target = ('recipe_id', 'user_id') if reverse else (
+        'user_id', 'recipe_id')
+    links = sender.objects.filter(**{source: instance.pk})
+    if pk_set is not None:
+        links = links.filter(**{f'{target}__in': pk_set})
+    return links
+
+
+def change_sign(action):
+    if action == 'post_add':
+        return 1
+    if action in ('pre_remove', 'pre_clear'):
+        return -1
+    return 0
+
+
+@receiver(m2m_changed, sender=User.favorite_list.through)
+@receiver(m2m_changed, sender=User.cart.through)
+def update_recipe_counters(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    delta = change_sign(action)
+    if not delta:
+        return
+    field = next(field for field, related in Recipe.COUNTERS.items()
+                 if getattr(Recipe, related).through is sender)
+    links = changed_links(sender, instance, reverse, pk_set)
+    if reverse:
+        delta *= links.count()
+        recipes = Recipe.objects.filter(id=instance.pk)
+    else:
+        recipes = Recipe.objects.filter(id__in=links.values('recipe_id'))
+    recipes.change_counter(field, delta)
+
+
+@receiver(m2m_changed, sender=User.cart.through)
+def update_shopping_lists(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    sign = change_sign(action)
+    if sign:
+        ShoppingListItem.objects.add_recipes(changed_links(
+            sender, instance, reverse, pk_set
+        ).values_list('user_id', 'recipe_id'), sign)
+
+
+# Удаление рецепта каскадом удаляет его из корзин без m2m_changed.
+@receiver(pre_delete, sender=Recipe)
+def remove_from_shopping_lists(instance, **kwargs):
+    ShoppingListItem.objects.add_recipes(
+        User.cart.through.objects.filter(recipe_id=instance.id).values_list(
+            'user_id', 'recipe_id'), -1)
+
+
+# Удаление пользователя каскадом удаляет его избранное и корзину
+# без m2m_changed.
+@receiver(pre_delete, sender=User)
+def update_counters_on_user_delete(instance, **kwargs):
+    for field, related in Recipe.COUNTERS.items():
+        Recipe.objects.filter(
+            id__in=getattr(Recipe, related).through.objects.filter(
+                user_id=instance.pk).values('recipe_id')
+        ).change_counter(field, -1)
+
+
+# Django 3.2 не проверяет постоянное соединение перед повторным
+# использованием (CONN_HEALTH_CHECKS появился в 4.1): соединение,
+# разорванное БД или PgBouncer, вернуло бы ошибку первому запросу.
+# Как и в 4.1, соединение проверяется при первом обращении к нему
+# в запросе, запросы без обращений к БД проверку не выполняют.
+def check_on_first_use(connection):
+    ensure_connection = connection.ensure_connection
+
+    def ensure():
+        if connection.health_check_pending and not (
+                connection.in_atomic_block):
+            connection.health_check_pending = False
+            if (connection.connection is not None
+                    and not connection.is_usable()):
+                connection.close()
+        ensure_connection()
+
+    connection.ensure_connection = ensure
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    enabled = settings.DB_CONN_HEALTH_CHECKS
+    for connection in connections.all():
+        if not hasattr(connection, 'health_check_pending'):
+            if not enabled:
+                continue
+            check_on_first_use(connection)
+        connection.health_check_pending = (
+            enabled and connection.connection is not None)
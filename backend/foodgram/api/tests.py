@@ -0,0 +1,738 @@
+import base64
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import IntegrityError, connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import metrics, transfer
+from api.authentication import CachedTokenAuthentication, local_cache
+from api.fields import Base64ImageField
+from api.management.commands.benchmark_api import parse_metrics
+from api.management.commands.compare_recipe_serializers import (
+    render_compiled, render_drf)
+from app.models import (Ingredient, Recipe, RecipeIngredient, ShoppingListItem,
+                        Subscription, Tag)
+
+User = get_user_model()
+
+GIF = base64.b64decode(
+    'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+LOCAL_CACHE = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class APITestCase(TestCase):
+    """ Авторы, теги, ингредиенты и рецепты с избранным и корзиной. """
+    recipes = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([
+            User(email=f'author{i}@test.ru', username=f'author{i}',
+                 first_name='Имя', last_name='Фамилия')
+            for i in range(4)
+        ])
+        cls.user = User.objects.create_user(
+            email='user@test.ru', username='user', first_name='Имя',
+            last_name='Фамилия', password='password')
+        cls.authors = list(User.objects.exclude(pk=cls.user.pk))
+        Tag.objects.bulk_create([
+            Tag(name='Завтрак', color='#E26C2D', slug='breakfast'),
+            Tag(name='Обед', color='#49B64E', slug='dinner'),
+        ])
+        cls.tags = list(Tag.objects.all())
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'Ингредиент {i}', measurement_unit='г')
+            for i in range(5)
+        ])
+        cls.ingredients = list(Ingredient.objects.all())
+        Recipe.objects.bulk_create([
+            Recipe(author=cls.authors[i % len(cls.authors)],
+                   name=f'Рецепт {i}', text='Описание', cooking_time=10,
+                   image='recipes/test.gif')
+            for i in range(cls.recipes)
+        ])
+        recipes = list(Recipe.objects.all())
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=100)
+            for recipe in recipes for ingredient in cls.ingredients[:3]
+        ])
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in cls.tags
+        ])
+        cls.user.favorite_list.add(*recipes[::3])
+        cls.user.cart.add(*recipes[::5])
+        Subscription.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+
+class RecipeListQueriesTest(APITestCase):
+
+    def count_queries(self, limit):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/recipes/',
+                                       {'page': 1, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(queries)
+
+    def check_page_sizes(self):
+        """ Число запросов не зависит от размера страницы. """
+        expected = self.count_queries(2)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            response = self.client.get('/api/recipes/',
+                                       {'page': 1, 'limit': self.recipes})
+        self.assertEqual(len(response.data['results']), self.recipes)
+
+    def test_page_size(self):
+        for compiled in (True, False):
+            with self.subTest(compiled=compiled), override_settings(
+                    COMPILED_RECIPE_SERIALIZER=compiled):
+                self.check_page_sizes()
+
+    def test_page_size_authenticated(self):
+        self.client.force_authenticate(self.user)
+        for compiled in (True, False):
+            with self.subTest(compiled=compiled), override_settings(
+                    COMPILED_RECIPE_SERIALIZER=compiled):
+                self.check_page_sizes()
+
+
+class RecipeKeysetPaginationTest(APITestCase):
+
+    def walk(self, params, limit=7):
+        """ Проходит ленту по ссылкам next до конца и обратно по previous. """
+        response = self.client.get(
+            '/api/recipes/', {**params, 'cursor': '', 'limit': limit})
+        pages = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.data),
+                             ['next', 'previous', 'results'])
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+        back = [pages[-1]]
+        while response.data['previous'] is not None:
+            response = self.client.get(response.data['previous'])
+            self.assertEqual(response.status_code, 200)
+            back.append([recipe['id'] for recipe in response.data['results']])
+        self.assertEqual(back[::-1], pages)
+        return [recipe_id for page in pages for recipe_id in page]
+
+    def expected(self, recipes, ordering=('-pub_date', '-id')):
+        return list(recipes.order_by(*ordering).values_list('id', flat=True))
+
+    def test_round_trip(self):
+        self.assertEqual(self.walk({}), self.expected(Recipe.objects))
+
+    def test_equal_pub_dates(self):
+        Recipe.objects.update(pub_date=timezone.now())
+        self.assertEqual(self.walk({}), self.expected(Recipe.objects))
+
+    def test_popular(self):
+        Recipe.objects.filter(id__in=self.expected(Recipe.objects)[:10:2]
+                              ).update(pub_date=timezone.now())
+        self.assertEqual(
+            self.walk({'ordering': 'popular'}, limit=4),
+            self.expected(Recipe.objects, Recipe.POPULAR_ORDERING))
+
+    def test_tags_with_cursor(self):
+        recipes = list(Recipe.objects.values_list('id', flat=True))
+        Recipe.tags.through.objects.filter(
+            recipe_id__in=recipes[::2], tag=self.tags[1]).delete()
+        self.assertEqual(
+            self.walk({'tags': self.tags[1].slug}),
+            self.expected(Recipe.objects.filter(tags=self.tags[1])))
+        self.assertEqual(
+            self.walk({'tags': [tag.slug for tag in self.tags]}),
+            self.expected(Recipe.objects))
+
+    def test_invalid_cursor(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(value.encode()).decode()
+
+        for cursor in ('!!!', encode('не json'), encode('5'), encode('{}'),
+                       encode('[false, "2020-01-01"]'),
+                       encode('[false, "вчера", "1"]'),
+                       encode('[false, "2020-01-01 00:00:00+00:00", "x"]')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/recipes/',
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_page_number(self):
+        response = self.client.get('/api/recipes/', {'page': 2, 'limit': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data),
+                         ['count', 'next', 'previous', 'results'])
+        self.assertEqual(response.data['count'], self.recipes)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            self.expected(Recipe.objects)[7:14])
+
+
+class RecipeCountersTest(APITestCase):
+
+    def test_save_keeps_counters(self):
+        """ Сохранение загруженного рецепта не перезаписывает счётчики,
+            изменённые после его чтения.
+        """
+        recipe = Recipe.objects.first()
+        Recipe.objects.filter(pk=recipe.pk).change_counter(
+            'favorites_count', 5)
+        Recipe.objects.filter(pk=recipe.pk).change_counter(
+            'in_carts_count', 3)
+        recipe.name = 'Новое название'
+        recipe.save()
+        saved = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual(saved.name, 'Новое название')
+        self.assertEqual(saved.favorites_count, recipe.favorites_count + 5)
+        self.assertEqual(saved.in_carts_count, recipe.in_carts_count + 3)
+
+    def test_user_delete_updates_counters(self):
+        other = User.objects.create_user(
+            email='other@test.ru', username='other', first_name='Имя',
+            last_name='Фамилия', password='password')
+        recipe = Recipe.objects.first()
+        self.user.favorite_list.add(recipe)
+        self.user.cart.add(recipe)
+        other.favorite_list.add(recipe)
+        other.cart.add(recipe)
+        before = Recipe.objects.get(pk=recipe.pk)
+        other.delete()
+        after = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual(after.favorites_count, before.favorites_count - 1)
+        self.assertEqual(after.in_carts_count, before.in_carts_count - 1)
+        Recipe.objects.recount()
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).favorites_count,
+                         after.favorites_count)
+
+
+class RecipeUpdateTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.filter(author=self.authors[0]).first()
+        self.client.force_authenticate(self.authors[0])
+
+    def update(self, tags):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'tags': tags, 'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 5}]},
+            format='json')
+
+    def test_tags(self):
+        response = self.update([self.tags[1].id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], [self.tags[1].id])
+
+    def test_invalid_tags(self):
+        for tags in ([0], ['abc'], 'abc'):
+            with self.subTest(tags=tags):
+                response = self.update(tags)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('tags', response.data)
+
+
+class RecipeRetrieveTest(APITestCase):
+
+    def test_invalid_pk(self):
+        for compiled in (True, False):
+            with self.subTest(compiled=compiled), override_settings(
+                    COMPILED_RECIPE_SERIALIZER=compiled):
+                response = self.client.get('/api/recipes/abc/')
+                self.assertEqual(response.status_code, 404)
+                response = self.client.get('/api/recipes/0/')
+                self.assertEqual(response.status_code, 404)
+
+    def test_similar_invalid_pk(self):
+        for path in ('/api/recipes/abc/similar/', '/api/recipes/0/similar/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 404)
+
+
+class CompiledSerializerTest(APITestCase):
+
+    def test_identical_output(self):
+        """ Компилированный сериализатор с FastJSONRenderer выдаёт те же
+            байты, что RecipeReadSerializer с JSONRenderer DRF.
+        """
+        for user in (AnonymousUser(), self.user):
+            for start, stop in ((0, 15), (15, self.recipes)):
+                with self.subTest(user=user, start=start):
+                    self.assertEqual(render_compiled(user, start, stop),
+                                     render_drf(user, start, stop))
+
+    def test_identical_responses(self):
+        self.client.force_authenticate(self.user)
+        for path in ('/api/recipes/?page=2&limit=10',
+                     f'/api/recipes/{Recipe.objects.first().id}/'):
+            responses = []
+            for compiled in (True, False):
+                cache.clear()
+                with override_settings(COMPILED_RECIPE_SERIALIZER=compiled):
+                    responses.append(self.client.get(path).content)
+            with self.subTest(path=path):
+                self.assertEqual(*responses)
+
+
+class ProfilingHeaderTest(APITestCase):
+
+    def get(self, **headers):
+        with override_settings(PROFILING='header',
+                               PROFILING_SECRET='secret'):
+            return self.client.get('/api/tags/', **headers)
+
+    def test_secret_required(self):
+        self.assertNotIn('Server-Timing', self.get())
+        self.assertNotIn('Server-Timing', self.get(HTTP_X_PROFILE='1'))
+        self.assertIn('Server-Timing', self.get(HTTP_X_PROFILE='secret'))
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_DIR='')
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_counters(self):
+        for _ in range(3):
+            self.client.get('/api/tags/')
+        self.client.get('/api/recipes/abc/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        samples = parse_metrics(response.content.decode())
+        tags = 'route="api:tag-list",method="GET"'
+        detail = 'route="api:recipe-detail",method="GET"'
+        self.assertEqual(samples[('foodgram_http_requests_total',
+                                  f'{tags},status="200"')], 3)
+        self.assertEqual(samples[('foodgram_http_requests_total',
+                                  f'{detail},status="404"')], 1)
+        self.assertEqual(samples[(
+            'foodgram_http_request_duration_seconds_count', tags)], 3)
+        self.assertEqual(samples[('foodgram_cache_requests_total',
+                                  'group="tags",result="miss"')], 1)
+        self.assertEqual(samples[('foodgram_cache_requests_total',
+                                  'group="tags",result="hit"')], 2)
+        self.assertGreater(sum(
+            value for (name, _), value in samples.items()
+            if name == 'foodgram_db_query_duration_seconds_count'), 0)
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        local_cache.clear()
+        self.key = Token.objects.create(user=self.user).key
+
+    def authenticate(self, method='get'):
+        request = getattr(APIRequestFactory(), method)(
+            '/', HTTP_AUTHORIZATION=f'Token {self.key}')
+        return CachedTokenAuthentication().authenticate(Request(request))
+
+    def test_read_from_cache(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual(user, self.user)
+
+    def test_write_reads_database(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.assertNumQueries(1), self.assertRaises(
+                AuthenticationFailed):
+            self.authenticate('post')
+
+    def test_logout_drops_cached_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_logout_during_database_read(self):
+        # Выход завершается между чтением токена из БД и записью в кэш
+        read = TokenAuthentication.authenticate_credentials
+
+        def read_then_logout(auth, key):
+            result = read(auth, key)
+            with self.captureOnCommitCallbacks(execute=True):
+                Token.objects.filter(key=key).delete()
+            return result
+
+        with mock.patch.object(TokenAuthentication, 'authenticate_credentials',
+                               read_then_logout):
+            self.authenticate()
+        # Кэш процесса другого процесса ограничен AUTH_LOCAL_CACHE_TIMEOUT
+        local_cache.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_process_local_cache_with_workers(self):
+        with override_settings(WEB_WORKERS=2):
+            self.authenticate()
+            with self.assertNumQueries(1):
+                self.authenticate()
+
+
+class LoadIngredientsTest(APITestCase):
+
+    def load(self, content, suffix='.json'):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f'ingredients{suffix}'
+            path.write_text(content, encoding='utf-8')
+            call_command('load_ingredients', str(path), stdout=mock.Mock())
+
+    def test_json_across_blocks(self):
+        items = [{'name': f'Соль {i}', 'measurement_unit': 'г'}
+                 for i in range(50)]
+        with mock.patch('app.management.commands.load_ingredients.'
+                        'READ_SIZE', 7):
+            self.load(json.dumps(items, ensure_ascii=False, indent=1))
+            self.load('\n'.join(json.dumps(item) for item in items),
+                      '.jsonl')
+        self.assertEqual(Ingredient.objects.filter(
+            name__startswith='Соль').count(), 50)
+
+    def test_invalid_items(self):
+        for content in ('[{"name": "z"}]', '[1]',
+                        '[{"name": "a", "measurement_unit": "г"}, '
+                        '{"name": "z", "measurement_unit": 5}]'):
+            with self.subTest(content=content), self.assertRaisesRegex(
+                    CommandError, r'Элемент \d'):
+                self.load(content)
+
+
+class DownloadShoppingCartTest(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def test_anonymous(self):
+        for file_format in ('txt', 'csv', 'pdf'):
+            with self.subTest(format=file_format):
+                response = self.client.get(self.url, {'format': file_format})
+                self.assertEqual(response.status_code, 401)
+                self.assertTrue(response['Content-Type'].startswith(
+                    'application/json'))
+                self.assertIn('detail', json.loads(response.content))
+
+    def download(self, file_format):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, {'format': file_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'.{file_format}"', response['Content-Disposition'])
+        return response, b''.join(response.streaming_content)
+
+    def test_txt(self):
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=utf-8')
+        lines = content.decode().splitlines()
+        self.assertEqual(len(lines), self.user.shopping_list.count())
+        self.assertTrue(lines[0].startswith('Ингредиент 0: '))
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = content.decode().splitlines()
+        self.assertEqual(rows[0], 'Ингредиент,Количество,Единица')
+        self.assertEqual(len(rows), self.user.shopping_list.count() + 1)
+
+    def test_pdf(self):
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+
+class ShoppingListTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.authors[1]
+        self.recipe = Recipe.objects.filter(author=self.authors[0]).first()
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredients[4], amount=7)
+
+    def assert_shopping_lists(self, *users):
+        """ Сохранённый список совпадает с собранным заново по корзине. """
+        for user in users:
+            self.client.force_authenticate(user)
+            response = self.client.get('/api/recipes/shopping_list/')
+            self.assertEqual(response.status_code, 200)
+            expected = dict(RecipeIngredient.objects.filter(
+                recipe__user_cart=user).values_list(
+                    'ingredient_id').annotate(Sum('amount')).order_by())
+            self.assertEqual(
+                {item['id']: item['amount'] for item in response.data},
+                expected)
+
+    def test_cart_changes(self):
+        recipes = Recipe.objects.exclude(user_cart=self.user)[:2]
+        self.user.cart.add(*recipes)
+        self.assert_shopping_lists(self.user)
+        self.user.cart.remove(recipes[0])
+        self.assert_shopping_lists(self.user)
+        self.recipe.user_cart.add(self.other)
+        self.assert_shopping_lists(self.user, self.other)
+        self.recipe.user_cart.remove(self.user)
+        self.assert_shopping_lists(self.user, self.other)
+        self.recipe.user_cart.clear()
+        self.assert_shopping_lists(self.user, self.other)
+        self.user.cart.clear()
+        self.assert_shopping_lists(self.user)
+        self.assertFalse(self.user.shopping_list.exists())
+
+    def test_cart_endpoint(self):
+        self.client.force_authenticate(self.other)
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assert_shopping_lists(self.other)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assert_shopping_lists(self.other)
+
+    def test_recipe_delete(self):
+        self.user.cart.add(self.recipe)
+        self.other.cart.add(self.recipe)
+        self.recipe.delete()
+        self.assert_shopping_lists(self.user, self.other)
+
+    def test_update_amounts(self):
+        self.user.cart.add(self.recipe)
+        self.other.cart.add(self.recipe)
+        self.client.force_authenticate(self.authors[0])
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'tags': [self.tags[0].id], 'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 5},
+                {'id': self.ingredients[3].id, 'amount': 30}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assert_shopping_lists(self.user, self.other)
+
+    def test_check_shopping_lists(self):
+        call_command('check_shopping_lists', stdout=mock.Mock())
+        ShoppingListItem.objects.filter(user=self.user).update(amount=1)
+        with self.assertRaisesRegex(CommandError, 'пользователей: 1'):
+            call_command('check_shopping_lists', stdout=mock.Mock())
+        call_command('check_shopping_lists', '--fix', stdout=mock.Mock())
+        call_command('check_shopping_lists', stdout=mock.Mock())
+        self.assert_shopping_lists(self.user)
+
+
+class ImportRecipesTest(APITestCase):
+    url = '/api/recipes/import/'
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media = override_settings(MEDIA_ROOT=self.media.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.admin = User.objects.create_user(
+            email='admin@test.ru', username='admin', first_name='Имя',
+            last_name='Фамилия', password='password', role='admin')
+
+    def row(self, name, **fields):
+        """ Строка импорта, поля со значением None не передаются. """
+        row = {
+            'name': name, 'text': 'Описание', 'cooking_time': 5,
+            'author': self.authors[0].email, 'tags': ['breakfast'],
+            'ingredients': [{'name': 'Ингредиент 0',
+                             'measurement_unit': 'г', 'amount': 10}],
+            'image': 'a.gif', **fields}
+        return json.dumps({key: value for key, value in row.items()
+                           if value is not None}, ensure_ascii=False)
+
+    def upload(self, lines):
+        return self.client.post(self.url, {
+            'file': SimpleUploadedFile('recipes.jsonl',
+                                       '\n'.join(lines).encode()),
+            'images': [SimpleUploadedFile('a.gif', GIF)],
+        }, format='multipart')
+
+    def stored_images(self):
+        return sorted(
+            path.name for path in Path(self.media.name).rglob('*')
+            if path.is_file())
+
+    def test_admin_only(self):
+        self.assertEqual(self.upload([self.row('Импорт')]).status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.upload([self.row('Импорт')]).status_code, 403)
+        self.assertFalse(Recipe.objects.filter(name='Импорт').exists())
+
+    def test_line_errors(self):
+        self.client.force_authenticate(self.admin)
+        response = self.upload([
+            self.row('Импорт 1'), '{', '[]', '',
+            self.row('Импорт 2', tags=['lunch']),
+            self.row('Импорт 3', image='b.gif'),
+            self.row('Импорт 4', author='nobody@test.ru'),
+            self.row('Импорт 5', author=None)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [(error['line'], list(error['errors']))
+             for error in response.data['errors']],
+            [(2, ['json']), (3, ['json']), (5, ['tags']), (6, ['image']),
+             (7, ['author'])])
+        self.assertEqual(
+            Recipe.objects.get(name='Импорт 1').author, self.authors[0])
+        self.assertEqual(Recipe.objects.get(name='Импорт 5').author,
+                         self.admin)
+
+    def test_chunk_fallback(self):
+        save_recipes = transfer.save_recipes
+
+        def fail_on_name(recipes):
+            save_recipes(recipes)
+            if any(recipe.name == 'Сбой' for recipe in recipes):
+                raise IntegrityError('сбой вставки')
+
+        lines = [self.row('Импорт 1'), self.row('Сбой'), self.row('Импорт 2')]
+        with mock.patch('api.transfer.save_recipes', fail_on_name):
+            report = transfer.import_recipes(
+                lines, transfer.uploaded_images(
+                    [SimpleUploadedFile('a.gif', GIF)]))
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['line'] for error in report['errors']], [2])
+        self.assertFalse(Recipe.objects.filter(name='Сбой').exists())
+        # Изображения откаченных вставок удалены из хранилища
+        self.assertEqual(self.stored_images(), sorted(
+            Path(image).name for image in Recipe.objects.filter(
+                name__startswith='Импорт').values_list('image', flat=True)))
+
+    def test_round_trip(self):
+        image = Path(self.media.name) / 'recipes' / 'test.gif'
+        image.parent.mkdir()
+        image.write_bytes(GIF)
+        originals = Recipe.objects.filter(author=self.authors[0])
+        exported = list(transfer.export_recipes(originals, chunk_size=3))
+        existing = list(Recipe.objects.values_list('id', flat=True))
+        report = transfer.import_recipes(
+            [json.dumps(row) for row in exported],
+            transfer.directory_images(self.media.name), chunk_size=4)
+        self.assertEqual(report, {'created': len(exported), 'errors': []})
+        imported = list(transfer.export_recipes(
+            Recipe.objects.exclude(id__in=existing), chunk_size=3))
+
+        def content(row):
+            return {**row, 'image': None}
+
+        self.assertEqual([content(row) for row in imported],
+                         [content(row) for row in exported])
+
+
+class Base64ImageFieldTest(SimpleTestCase):
+
+    def decode(self, data):
+        return Base64ImageField().to_internal_value(data)
+
+    def assert_fails(self, data, code):
+        with self.assertRaises(ValidationError) as error:
+            self.decode(data)
+        self.assertEqual(error.exception.detail[0].code, code)
+
+    def data_uri(self, content):
+        return 'data:image/gif;base64,' + base64.b64encode(content).decode()
+
+    def test_decode(self):
+        with mock.patch('api.fields.CHUNK_SIZE', 8):
+            file = self.decode(self.data_uri(GIF))
+        self.assertEqual(file.name, 'temp.gif')
+        self.assertEqual(file.read(), GIF)
+        self.assertFalse(file.file._rolled)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_large_image_on_disk(self):
+        file = self.decode(self.data_uri(GIF))
+        self.assertTrue(file.file._rolled)
+        self.assertEqual(file.read(), GIF)
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=len(GIF) - 1)
+    def test_size_checked_before_decoding(self):
+        with mock.patch('api.fields.base64.b64decode') as decode:
+            self.assert_fails(self.data_uri(GIF), 'too_large')
+        decode.assert_not_called()
+
+    def test_invalid_base64(self):
+        for data in ('data:image/gif;base64,R0lG*ODlh',
+                     'data:image/gif;base64,R0lGODl',
+                     'data:text/plain;base64,' + base64.b64encode(
+                         GIF).decode()):
+            with self.subTest(data=data):
+                self.assert_fails(data, 'invalid_base64')
+
+    def test_not_an_image(self):
+        self.assert_fails(self.data_uri(b'not an image'), 'invalid_image')
+
+    def test_line_breaks(self):
+        # base64 в формате MIME переносится по 76 символов
+        encoded = base64.encodebytes(GIF * 4).decode().replace('\n', '\r\n')
+        self.assertIn('\r\n', encoded.strip())
+        with mock.patch('api.fields.CHUNK_SIZE', 8):
+            file = self.decode('data:image/gif;base64,' + encoded)
+        self.assertEqual(file.read(), GIF * 4)
+
+
+class ConnectionHealthCheckTest(TestCase):
+
+    def request(self, usable):
+        """ Начало запроса и два обращения к БД в нём. Проверка
+            выполняется вне транзакции, в которую тест обёрнут.
+        """
+        request_started.send(sender=None)
+        with mock.patch.object(connection, 'is_usable',
+                               return_value=usable) as is_usable, \
+                mock.patch.object(connection, 'close') as close, \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertFalse(is_usable.called)
+            User.objects.count()
+            User.objects.count()
+        return is_usable.call_count, close.call_count
+
+    def test_checked_on_first_use(self):
+        self.assertEqual(self.request(True), (1, 0))
+        self.assertEqual(self.request(False), (1, 1))
+
+    def test_disabled(self):
+        request_started.send(sender=None)
+        with override_settings(DB_CONN_HEALTH_CHECKS=False):
+            self.assertEqual(self.request(False), (0, 0))
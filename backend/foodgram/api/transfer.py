@@ -0,0 +1,232 @@
+import json
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files import File
+from django.db import DatabaseError, connection, transaction
+
+from . import cache, compiled, images
+from .serializers import RecipeImportSerializer
+from app.models import Ingredient, Recipe, RecipeIngredient, Tag
+
+User = get_user_model()
+
+CHUNK_SIZE = 100
+
+
+def directory_images(root):
+    """ Открывает изображения импорта из каталога root,
+        не выходя за его пределы.
+    """
+    root = Path(root).resolve()
+
+    def open_image(name):
+        path = (root / name).resolve()
+        if root not in path.parents or not path.is_file():
+            return None
+        return File(path.open('rb'), name=path.name)
+    return open_image
+
+
+def uploaded_images(files):
+    """ Изображения импорта из загруженных файлов, по имени файла. """
+    files = {file.name: file for file in files}
+    return lambda name: files.get(Path(name).name)
+
+
+def read_lines(lines, report):
+    """ Разбирает строки NDJSON в пары (номер строки, объект). """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            report['errors'].append({'line': number,
+                                     'errors': {'json': [str(error)]}})
+            continue
+        if not isinstance(row, dict):
+            report['errors'].append({'line': number, 'errors': {
+                'json': ['Строка должна содержать объект.']}})
+            continue
+        yield number, row
+
+
+def lookups(rows):
+    """ Теги, ингредиенты и авторы, упомянутые в пачке строк,
+        тремя запросами.
+    """
+    slugs, names, emails = set(), set(), set()
+    for _, row in rows:
+        if isinstance(row.get('tags'), list):
+            slugs.update(slug for slug in row['tags']
+                         if isinstance(slug, str))
+        if isinstance(row.get('ingredients'), list):
+            names.update(item.get('name') for item in row['ingredients']
+                         if isinstance(item, dict)
+                         and isinstance(item.get('name'), str))
+        if isinstance(row.get('author'), str):
+            emails.add(row['author'])
+    return {
+        'tags': Tag.objects.in_bulk(slugs, field_name='slug'),
+        'ingredients': {
+            (ingredient.name, ingredient.measurement_unit): ingredient
+            for ingredient in Ingredient.objects.filter(name__in=names)
+        },
+        'authors': User.objects.in_bulk(emails, field_name='email'),
+    }
+
+
+def save_recipes(recipes):
+    """ bulk_create возвращает id только в PostgreSQL, в остальных СУБД
+        рецепты сохраняются по одному, миниатюры тогда ставит
+        в очередь post_save.
+    """
+    if not connection.features.can_return_rows_from_bulk_insert:
+        for recipe in recipes:
+            recipe.save()
+        return
+    Recipe.objects.bulk_create(recipes)
+    for recipe in recipes:
+        images.schedule(recipe.id)
+
+
+def build(rows):
+    """ Рецепты проверенных строк с их тегами и ингредиентами. """
+    recipes = []
+    for data in rows:
+        data = dict(data)
+        tags = data.pop('tags')
+        ingredients = data.pop('ingredients')
+        recipes.append((Recipe(**data), tags, ingredients))
+    return recipes
+
+
+def insert(recipes):
+    """ Сохраняет рецепты, их ингредиенты и теги —
+        по одному bulk_create на таблицу.
+    """
+    save_recipes([recipe for recipe, _, _ in recipes])
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient=item['id'],
+                         amount=item['amount'])
+        for recipe, _, ingredients in recipes for item in ingredients
+    ])
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+        for recipe, tags, _ in recipes for tag in tags
+    ])
+
+
+def discard_images(recipes):
+    """ Удаляет из хранилища изображения, записанные при сохранении
+        рецептов до отката транзакции.
+    """
+    for recipe, _, _ in recipes:
+        if recipe.image and recipe.image._committed:
+            recipe.image.delete(save=False)
+
+
+def save_chunk(valid, report):
+    """ Сохраняет пачку проверенных строк в одной транзакции.
+        Если пачка не сохранилась, строки сохраняются по одной,
+        чтобы найти ошибочные.
+    """
+    recipes = build(data for _, data in valid)
+    try:
+        with transaction.atomic():
+            insert(recipes)
+        report['created'] += len(valid)
+        return
+    except DatabaseError:
+        discard_images(recipes)
+    for number, data in valid:
+        recipes = build([data])
+        try:
+            with transaction.atomic():
+                insert(recipes)
+            report['created'] += 1
+        except DatabaseError as error:
+            discard_images(recipes)
+            report['errors'].append({'line': number, 'errors': {
+                'non_field_errors': [str(error)]}})
+
+
+def import_chunk(rows, open_image, author, report):
+    """ Проверяет пачку строк правилами RecipeImportSerializer
+        и сохраняет прошедшие проверку.
+    """
+    opened = []
+
+    def track(name):
+        file = open_image(name)
+        if file is not None:
+            opened.append(file)
+        return file
+
+    context = {**lookups(rows), 'author': author, 'open_image': track}
+    valid = []
+    try:
+        for number, row in rows:
+            serializer = RecipeImportSerializer(data=row, context=context)
+            if serializer.is_valid():
+                valid.append((number, serializer.validated_data))
+            else:
+                report['errors'].append({'line': number,
+                                         'errors': serializer.errors})
+        save_chunk(valid, report)
+    finally:
+        for file in opened:
+            file.close()
+
+
+def import_recipes(lines, open_image, author=None, chunk_size=CHUNK_SIZE,
+                   progress=None):
+    """ Импортирует рецепты из строк NDJSON пачками по chunk_size.
+        Ошибочные строки попадают в отчёт и не прерывают импорт.
+    """
+    report = {'created': 0, 'errors': []}
+    rows = read_lines(lines, report)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        import_chunk(chunk, open_image, author, report)
+        if progress:
+            progress(report)
+    if report['created']:
+        cache.bump_version('recipes')
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
+
+
+def export_recipes(queryset, chunk_size=CHUNK_SIZE):
+    """ Рецепты в формате импорта, пачками по id. Строки собирает
+        компилированный сериализатор, имя изображения — путь в хранилище.
+    """
+    user = AnonymousUser()
+    last_id = 0
+    while True:
+        rows = list(compiled.rows(
+            queryset.filter(id__gt=last_id).order_by('id'), user
+        )[:chunk_size])
+        if not rows:
+            return
+        for row, recipe in zip(rows, compiled.serialize(rows, user)):
+            yield {
+                'name': recipe['name'],
+                'text': recipe['text'],
+                'cooking_time': recipe['cooking_time'],
+                'author': recipe['author']['email'],
+                'tags': [tag['slug'] for tag in recipe['tags']],
+                'ingredients': [
+                    {'name': item['name'],
+                     'measurement_unit': item['measurement_unit'],
+                     'amount': item['amount']}
+                    for item in recipe['ingredients']
+                ],
+                'image': row['image'],
+            }
+        last_id = rows[-1]['id']
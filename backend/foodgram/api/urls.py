@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import (IngredientViewSet, RecipeViewSet, SubscriptionViewSet,
-                    TagViewSet, UserViewSet)
+from .views import (IngredientViewSet, ProfilingView, RecipeViewSet,
+                    SubscriptionViewSet, TagViewSet, UserViewSet)
 
 app_name = 'api'
 
@@ -17,5 +17,6 @@ router.register(r'users', UserViewSet)
 
 urlpatterns = [
     path(r'auth/', include('djoser.urls.authtoken')),
+    path(r'profiling/', ProfilingView.as_view(), name='profiling'),
     path(r'', include(router.urls)),
 ]
@@ -0,0 +1,12 @@
+from django.urls import include, path
+
+from .async_views import async_patterns
+from .urls import router
+from .urls import urlpatterns as wsgi_urlpatterns
+
+app_name = 'api'
+
+urlpatterns = [
+    path(r'', include(async_patterns(router.urls))),
+    *wsgi_urlpatterns,
+]
@@ -1,8 +1,22 @@
+from collections import defaultdict
+
+from django.db import transaction
 from rest_framework import status
 from rest_framework.response import Response
 
-from api import serializers
-from app.models import RecipeIngredient
+from api import cache, serializers
+from app.models import Recipe, RecipeIngredient, ShoppingListItem
+
+RECIPES_LIMIT = 3
+
+
+def get_recipes_limit(request):
+    """ Значение параметра recipes_limit для списка подписок """
+    try:
+        limit = int(request.query_params.get('recipes_limit', RECIPES_LIMIT))
+    except ValueError:
+        return RECIPES_LIMIT
+    return limit if limit > 0 else RECIPES_LIMIT
 
 
 def add_ingredients(recipe, ingredients):
@@ -15,25 +29,100 @@ def add_ingredients(recipe, ingredients):
     ])
 
 
-def add_to_list(recipe, queryset, request):
-    """ Добавляет или удаляет объект модели из списка ManyToMany """
+def update_ingredients(recipe, ingredients):
+    """ Приводит ингредиенты рецепта к переданным, меняя только
+        отличающиеся строки. Возвращает прежние количества.
+    """
+    current = {item.ingredient_id: item for item in recipe.recipe_ing.all()}
+    old_amounts = {ingredient_id: item.amount
+                   for ingredient_id, item in current.items()}
+    amounts = {item['id'].id: item['amount'] for item in ingredients}
+    removed = current.keys() - amounts.keys()
+    if removed:
+        recipe.recipe_ing.filter(ingredient_id__in=removed).delete()
+    changed = []
+    for ingredient_id, amount in amounts.items():
+        item = current.get(ingredient_id)
+        if item is not None and item.amount != amount:
+            item.amount = amount
+            changed.append(item)
+    RecipeIngredient.objects.bulk_update(changed, ['amount'])
+    add_ingredients(recipe, [item for item in ingredients
+                             if item['id'].id not in current])
+    return old_amounts
+
+
+def apply_user_flags(recipes, user):
+    """ Проставляет в сериализованных рецептах флаги пользователя """
+    recipe_ids = sorted(recipe['id'] for recipe in recipes)
+    author_ids = sorted({recipe['author']['id'] for recipe in recipes})
+    favorites, cart, following = cache.get_user_flags(user, recipe_ids,
+                                                      author_ids)
+    return [
+        {
+            **recipe,
+            'author': {**recipe['author'],
+                       'is_subscribed': recipe['author']['id'] in following},
+            'is_favorited': recipe['id'] in favorites,
+            'is_in_shopping_cart': recipe['id'] in cart,
+        }
+        for recipe in recipes
+    ]
+
+
+def update_shopping_lists(recipe, old_amounts, ingredients):
+    """ Переносит изменение ингредиентов рецепта в списки покупок
+        пользователей, у которых рецепт в корзине.
+    """
+    changes = defaultdict(int, {ingredient_id: -amount for ingredient_id,
+                                amount in old_amounts.items()})
+    for ingredient in ingredients:
+        changes[ingredient['id'].id] += ingredient['amount']
+    changes = {key: delta for key, delta in changes.items() if delta}
+    if not changes:
+        return
+    user_ids = recipe.user_cart.through.objects.filter(
+        recipe_id=recipe.id).values_list('user_id', flat=True)
+    ShoppingListItem.objects.apply({
+        (user_id, ingredient_id): delta
+        for user_id in user_ids
+        for ingredient_id, delta in changes.items()
+    })
+
+
+def add_to_list(recipe, queryset, request, counter, shopping_list=False):
+    """ Добавляет или удаляет объект модели из списка ManyToMany
+        и меняет счётчик рецепта в той же транзакции. Для корзины
+        (shopping_list) там же обновляется список покупок.
+    """
     exists = queryset.objects.filter(recipe_id=recipe.id,
                                      user_id=request.user.id)
+    recipes = Recipe.objects.filter(id=recipe.id)
     if request.method == 'POST':
         if exists:
             content = {'errors': 'Рецепт уже в списке'}
             return Response(content, status=status.HTTP_400_BAD_REQUEST)
-        queryset.objects.create(
-            recipe_id=recipe.id,
-            user_id=request.user.id
-        )
+        with transaction.atomic():
+            queryset.objects.create(
+                recipe_id=recipe.id,
+                user_id=request.user.id
+            )
+            recipes.change_counter(counter, 1)
+            if shopping_list:
+                ShoppingListItem.objects.add_recipes(
+                    [(request.user.id, recipe.id)])
+        cache.bump_version(cache.user_group(request.user.id))
         serializer = serializers.RecipeSubSerializer(recipe)
         return Response(serializer.data)
-    if exists:
-        queryset.objects.get(
-            recipe_id=recipe.id,
-            user_id=request.user.id
-        ).delete()
+    with transaction.atomic():
+        deleted, _ = exists.delete()
+        if deleted:
+            recipes.change_counter(counter, -deleted)
+            if shopping_list:
+                ShoppingListItem.objects.add_recipes(
+                    [(request.user.id, recipe.id)], -1)
+    if deleted:
+        cache.bump_version(cache.user_group(request.user.id))
         return Response(status=status.HTTP_204_NO_CONTENT)
     content = {'errors': 'Рецепт отсутствует в списке'}
     return Response(content, status=status.HTTP_400_BAD_REQUEST)
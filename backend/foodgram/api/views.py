@@ -1,29 +1,39 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import (BooleanField, Count, F, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.utils import dateformat, timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from . import cache, compiled, metrics, profiling, search, transfer
 from .filters import IngredientFilter, RecipeFilter
-from .mixins import ListRetrieveViewSet, ListViewSet
-from .pagination import RecipePagination
-from .permissions import IsOwnerOrAdmin, ReadOnly
+from .mixins import (CachedResponseMixin, ListRetrieveViewSet, ListViewSet,
+                     UserFlagsMixin)
+from .pagination import RecipePagination, SubscriptionPagination
+from .permissions import IsAdmin, IsOwnerOrAdmin, ReadOnly
+from .renderers import (SHOPPING_CART_RENDERERS, FastJSONRenderer,
+                        ShoppingCartRenderer)
 from .serializers import (ChangePasswordSerializer, IngredientSerializer,
                           RecipeReadSerializer, RecipeSerializer,
+                          RecipeSubSerializer, ShoppingListSerializer,
                           TagSerializer, UserSerializer, UserSignUpSerializer,
                           UserSubSerializer)
-from .utils import add_to_list
-from app.models import Ingredient, Recipe, RecipeIngredient, Subscription, Tag
+from .utils import add_to_list, apply_user_flags, get_recipes_limit
+from app.models import Ingredient, Recipe, RecipeSimilarity, Subscription, Tag
 
 User = get_user_model()
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(UserFlagsMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     filter_backends = (filters.SearchFilter, )
@@ -53,7 +63,7 @@ class UserViewSet(viewsets.ModelViewSet):
                                               context={'request': request})
         serializer.is_valid(raise_exception=True)
         request.user.set_password(serializer.validated_data['new_password'])
-        request.user.save()
+        request.user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -62,7 +72,8 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def me(self, request):
-        serializer = UserSerializer(request.user, context={'request': request})
+        serializer = UserSerializer(request.user,
+                                    context=self.get_serializer_context())
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(
@@ -81,8 +92,8 @@ class UserViewSet(viewsets.ModelViewSet):
                                 status=status.HTTP_400_BAD_REQUEST)
 
             Subscription.objects.create(user=user, author=author)
-            serializer = UserSubSerializer(author,
-                                           context={'request': request})
+            serializer = UserSubSerializer(
+                author, context=self.get_serializer_context())
             return Response(serializer.data)
 
         if exists:
@@ -92,14 +103,16 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(content, status=status.HTTP_400_BAD_REQUEST)
 
 
-class TagViewSet(ListRetrieveViewSet):
+class TagViewSet(CachedResponseMixin, ListRetrieveViewSet):
+    cache_group = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [ReadOnly]
     pagination_class = None
 
 
-class IngredientViewSet(ListRetrieveViewSet):
+class IngredientViewSet(CachedResponseMixin, ListRetrieveViewSet):
+    cache_group = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [ReadOnly]
@@ -107,8 +120,22 @@ class IngredientViewSet(ListRetrieveViewSet):
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        if not search.enabled():
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.search_list, request,
+                                    *args, **kwargs)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+    def search_list(self, request, *args, **kwargs):
+        index = search.get_index()
+        name = request.query_params.get('name')
+        if name:
+            return Response(
+                index.search(name, settings.INGREDIENT_SEARCH_LIMIT))
+        return Response(index.all())
+
+
+class RecipeViewSet(UserFlagsMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = [IsOwnerOrAdmin | ReadOnly]
     serializer_class = RecipeSerializer
@@ -116,68 +143,219 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     pagination_class = RecipePagination
 
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.for_read(self.request.user)
+        # Автор нужен для проверки прав и ответа
+        return Recipe.objects.select_related('author')
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeSerializer
 
+    def list(self, request, *args, **kwargs):
+        """ Лента кэшируется для анонимного пользователя, флаги
+            текущего пользователя накладываются поверх неё.
+        """
+        # Порядок по популярности меняется с каждым добавлением
+        # в избранное, такую ленту не кэшируем.
+        if (request.accepted_renderer.format != 'json'
+                or {'is_favorited', 'is_in_shopping_cart', 'ordering'}
+                & set(request.query_params)):
+            return Response(self.read_page(request.user))
+        data = cache.get_data('recipes', request)
+        hit = data is not None
+        if not hit:
+            data = self.read_page(AnonymousUser())
+            cache.set_data('recipes', request, data)
+        if request.user.is_authenticated:
+            with profiling.span('flags'):
+                if isinstance(data, dict):
+                    data = {**data, 'results': apply_user_flags(
+                        data['results'], request.user)}
+                else:
+                    data = apply_user_flags(data, request.user)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.COMPILED_RECIPE_SERIALIZER:
+            return super().retrieve(request, *args, **kwargs)
+        row = get_object_or_404(
+            compiled.rows(Recipe.objects.all(), request.user),
+            pk=kwargs[self.lookup_field])
+        with profiling.span('serialize'):
+            data = compiled.serialize([row], request.user)[0]
+        return Response(data)
+
+    def read_page(self, user):
+        """ Страница ленты с флагами пользователя user. """
+        if settings.COMPILED_RECIPE_SERIALIZER:
+            queryset = compiled.rows(Recipe.objects.all(), user)
+        else:
+            queryset = Recipe.objects.for_read(user)
+        queryset = self.filter_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        data = self.serialize(queryset if page is None else page, user)
+        if page is None:
+            return data
+        return self.get_paginated_response(data).data
+
+    @profiling.span('serialize')
+    def serialize(self, recipes, user):
+        if settings.COMPILED_RECIPE_SERIALIZER:
+            return compiled.serialize(recipes, user)
+        return self.get_serializer(recipes, many=True).data
+
     def get_permissions(self):
         permission_classes = []
-        if self.action in ['create', 'shopping_cart', 'favorite']:
+        if self.action in ['create', 'shopping_cart', 'favorite',
+                           'download_shopping_cart', 'shopping_list']:
             permission_classes = [IsAuthenticated]
-        elif self.action == 'retrieve' or self.action == 'list':
+        elif self.action == 'import_recipes':
+            permission_classes = [IsAdmin]
+        elif self.action in ('retrieve', 'list', 'similar'):
             permission_classes = [AllowAny]
         elif self.action == 'destroy' or 'update':
             permission_classes = [IsOwnerOrAdmin]
 
         return [permission() for permission in permission_classes]
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        """ Ошибки выгрузки списка покупок (401, 404) отдаются в JSON,
+            а не в формате файла, выбранном для ответа.
+        """
+        response = super().finalize_response(request, response, *args,
+                                             **kwargs)
+        if getattr(response, 'exception', False) and isinstance(
+                getattr(response, 'accepted_renderer', None),
+                ShoppingCartRenderer):
+            response.accepted_renderer = FastJSONRenderer()
+            response.accepted_media_type = FastJSONRenderer.media_type
+        return response
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk=None):
+        """ Похожие рецепты, рассчитанные build_recommendations:
+            один запрос по индексу (recipe_id, -score).
+        """
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        rows = list(RecipeSimilarity.objects.filter(
+            recipe_id=pk).select_related('similar').order_by('-score'))
+        if not rows and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response(RecipeSubSerializer(
+            [row.similar for row in rows], many=True).data)
+
     @action(methods=['post', 'delete'], detail=True)
     def favorite(self, request, pk=None):
         recipe = self.get_object()
         favorite = request.user.favorite_list.through
-        return add_to_list(recipe, favorite, request)
+        return add_to_list(recipe, favorite, request, 'favorites_count')
 
     @action(methods=['post', 'delete'], detail=True)
     def shopping_cart(self, request, pk=None):
         recipe = self.get_object()
         cart = request.user.cart.through
-        return add_to_list(recipe, cart, request)
+        return add_to_list(recipe, cart, request, 'in_carts_count',
+                           shopping_list=True)
 
     @action(methods=['get'],
             detail=False,
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=SHOPPING_CART_RENDERERS)
     def download_shopping_cart(self, request):
-        cart = request.user.cart.all()
-        ingredients = RecipeIngredient.objects.select_related('recipe').filter(
-            recipe_id__in=cart).values(
-                'ingredient__name',
-                'ingredient__measurement_unit').annotate(
-                    sum_amount=Sum('amount'))
-        text_content = ''
-        for ing in ingredients:
-            text_content += (f'{ing["ingredient__name"]}: '
-                             f'{ing["sum_amount"]} '
-                             f'{ing["ingredient__measurement_unit"]}\n')
+        renderer = request.accepted_renderer
+        ingredients = request.user.shopping_list.annotate(
+            sum_amount=F('amount')).values(
+                'ingredient__name', 'ingredient__measurement_unit',
+                'sum_amount').order_by(
+                    'ingredient__name', 'ingredient__measurement_unit')
         now = dateformat.format(timezone.now(), 'd-m-Y H-i')
-        response = HttpResponse(content_type='text/plain')
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=renderer.content_type
+        )
         response['Content-Disposition'] = (f'attachment;'
                                            f'filename="{request.user.username}'
-                                           f'_shopping_cart {now}.txt"')
-        response.write(text_content)
+                                           f'_shopping_cart {now}.'
+                                           f'{renderer.format}"')
         return response
 
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[IsAuthenticated])
+    def shopping_list(self, request):
+        items = request.user.shopping_list.select_related(
+            'ingredient').order_by('ingredient__name')
+        return Response(ShoppingListSerializer(items, many=True).data)
+
+    @action(methods=['post'],
+            detail=False,
+            url_path='import',
+            parser_classes=[MultiPartParser])
+    def import_recipes(self, request):
+        """ Импорт рецептов: файл JSON Lines в поле file, изображения
+            в полях images. Строки без автора получает текущий
+            пользователь, ошибки возвращаются по номерам строк.
+        """
+        if 'file' not in request.FILES:
+            return Response({'file': ['Файл не передан.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        report = transfer.import_recipes(
+            request.FILES['file'],
+            transfer.uploaded_images(request.FILES.getlist('images')),
+            request.user)
+        return Response(report, status=status.HTTP_201_CREATED
+                        if report['created'] else status.HTTP_400_BAD_REQUEST)
+
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
 
-class SubscriptionViewSet(ListViewSet):
+class SubscriptionViewSet(UserFlagsMixin, ListViewSet):
     serializer_class = UserSubSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = RecipePagination
+    pagination_class = SubscriptionPagination
 
     def get_queryset(self):
-        queryset = self.request.user.follower.all()
+        limit = get_recipes_limit(self.request)
+        limited_recipes = Recipe.objects.filter(id__in=Subquery(
+            Recipe.objects.filter(
+                author_id=OuterRef('author_id')).values('id')[:limit]
+        ))
         return User.objects.filter(
-            id__in=queryset.values('author_id')
-        )
+            id__in=self.request.user.follower.values('author_id')
+        ).annotate(
+            recipes_count=Count('recipes'),
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(
+            Prefetch('recipes', queryset=limited_recipes,
+                     to_attr='limited_recipes')
+        ).order_by('id')
+
+
+class ProfilingView(APIView):
+    """ Перцентили времени и числа запросов к БД по маршрутам,
+        собранные ProfilingMiddleware в этом процессе.
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(profiling.registry.table())
+
+    def delete(self, request):
+        profiling.registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def metrics_view(request):
+    """ Метрики в текстовом формате Prometheus. """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics.exposition(metrics.collect()),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
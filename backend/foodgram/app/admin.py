@@ -5,7 +5,8 @@ from .models import Ingredient, Recipe, Subscription, Tag
 
 class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags')
-    list_display = ('pk', 'name', 'author')
+    list_display = ('pk', 'name', 'author', 'favorites_count',
+                    'in_carts_count')
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты по совместным добавлениям '
+            'в избранное и корзины')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int,
+                            default=recommendations.TOP_K,
+                            help='Сколько похожих рецептов хранить')
+        parser.add_argument('--cart-weight', type=float,
+                            default=recommendations.CART_WEIGHT,
+                            help='Вес корзины относительно избранного')
+        parser.add_argument('--max-user-items', type=int,
+                            default=recommendations.MAX_USER_ITEMS,
+                            help='Пропускать пользователей, у которых '
+                                 'больше рецептов')
+        parser.add_argument('--batch-size', type=int,
+                            default=recommendations.BATCH_SIZE,
+                            help='Рецептов в одной транзакции')
+
+    def handle(self, *args, **options):
+        report = recommendations.build(
+            options['top_k'], options['cart_weight'],
+            options['max_user_items'], options['batch_size'], self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {report["users"]} '
+            f'(пропущено {report["skipped_users"]}), '
+            f'связей: {report["links"]}, рецептов: {report["recipes"]}, '
+            f'похожих: {report["rows"]}, секунд: {report["seconds"]}'))
+
+    def progress(self, report):
+        self.stdout.write(f'Обработано рецептов: {report["recipes"]}')
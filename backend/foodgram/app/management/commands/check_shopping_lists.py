@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Собирает списки покупок заново по корзинам и сравнивает '
+            'с сохранёнными')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', nargs='*', type=int, default=None,
+                            help='id пользователей, по умолчанию все')
+        parser.add_argument('--fix', action='store_true',
+                            help='Перестроить списки с расхождениями')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Сколько расхождений вывести')
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        expected = ShoppingListItem.objects.from_carts(user_ids)
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in items.values_list(
+                'user_id', 'ingredient_id', 'amount').iterator()
+        }
+        diff = sorted(
+            (key, actual.get(key), expected.get(key))
+            for key in expected.keys() | actual.keys()
+            if actual.get(key) != expected.get(key)
+        )
+        for (user_id, ingredient_id), stored, rebuilt in (
+                diff[:options['show']]):
+            self.stdout.write(
+                f'Пользователь {user_id}, ингредиент {ingredient_id}: '
+                f'сохранено {stored}, по корзине {rebuilt}')
+        if not diff:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+        broken = sorted({user_id for (user_id, _), _, _ in diff})
+        if not options['fix']:
+            raise CommandError(
+                f'Расхождений: {len(diff)}, пользователей: {len(broken)}')
+        ShoppingListItem.objects.rebuild(broken)
+        self.stdout.write(self.style.SUCCESS(
+            f'Перестроены списки пользователей: {len(broken)}'))
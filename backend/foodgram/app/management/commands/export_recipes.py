@@ -0,0 +1,48 @@
+import json
+import shutil
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from api import transfer
+from app.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Выгружает рецепты в файл JSON Lines для import_recipes, '
+            'изображения копируются в каталог рядом с ним')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу выгрузки')
+        parser.add_argument('--images',
+                            help='Каталог изображений, по умолчанию '
+                                 'images рядом с файлом')
+        parser.add_argument('--authors', nargs='*', default=None,
+                            help='Email авторов, по умолчанию все')
+        parser.add_argument('--chunk-size', type=int,
+                            default=transfer.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        images = Path(options['images'] or path.parent / 'images')
+        recipes = Recipe.objects.all()
+        if options['authors'] is not None:
+            recipes = recipes.filter(author__email__in=options['authors'])
+        storage = Recipe._meta.get_field('image').storage
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        exported = 0
+        with open(path, 'w', encoding='utf-8') as file:
+            for row in transfer.export_recipes(recipes,
+                                               options['chunk_size']):
+                target = images / row['image']
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with storage.open(row['image']) as source, \
+                        open(target, 'wb') as copy:
+                    shutil.copyfileobj(source, copy)
+                file.write(json.dumps(row, ensure_ascii=False) + '\n')
+                exported += 1
+                if not exported % options['chunk_size']:
+                    self.stdout.write(f'Выгружено рецептов: {exported}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {exported}'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api import images
+from app.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры для изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Проверить все рецепты, а не только '
+                                 'рецепты без миниатюр')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(thumbnail='') | recipes.filter(
+                thumbnail_webp='')
+        updated = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            updated += images.process(recipe_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено рецептов: {updated}'))
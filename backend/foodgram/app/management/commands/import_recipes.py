@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api import transfer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Импортирует рецепты из файла JSON Lines, изображения '
+            'берутся из каталога рядом с ним')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с рецептами')
+        parser.add_argument('--images',
+                            help='Каталог изображений, по умолчанию '
+                                 'images рядом с файлом')
+        parser.add_argument('--author',
+                            help='Email автора для строк без автора')
+        parser.add_argument('--chunk-size', type=int,
+                            default=transfer.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        author = None
+        if options['author']:
+            author = User.objects.filter(email=options['author']).first()
+            if author is None:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден')
+        images = Path(options['images'] or path.parent / 'images')
+
+        with open(path, encoding='utf-8') as file:
+            report = transfer.import_recipes(
+                file, transfer.directory_images(images), author,
+                options['chunk_size'], self.progress)
+        for error in report['errors']:
+            self.stdout.write(f'Строка {error["line"]}: '
+                              + json.dumps(error['errors'],
+                                           ensure_ascii=False))
+        if report['errors']:
+            raise CommandError(
+                f'Добавлено рецептов: {report["created"]}, '
+                f'строк с ошибками: {len(report["errors"])}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено рецептов: {report["created"]}'))
+
+    def progress(self, report):
+        self.stdout.write(f'Добавлено рецептов: {report["created"]}, '
+                          f'ошибок: {len(report["errors"])}')
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+import re
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api import cache
+from app.models import Ingredient
+
+HEADER = ('name', 'measurement_unit')
+READ_SIZE = 64 * 1024
+# Пробелы и разделители между элементами массива или строками JSON Lines
+SEPARATORS = re.compile(r'[\s\[,\]]*')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2 and tuple(row[:2]) != HEADER:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """ Потоково читает JSON-массив объектов или JSON Lines. Буфер
+        копируется только при чтении очередного блока, элементы
+        разбираются с позиции в нём.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = number = 0
+    while True:
+        block = file.read(READ_SIZE)
+        buffer = buffer[pos:] + block
+        pos = 0
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not block:
+                    raise CommandError('Некорректный JSON')
+                break
+            number += 1
+            yield parse_item(item, number)
+            pos = end
+        if not block:
+            return
+
+
+def parse_item(item, number):
+    try:
+        name, unit = item['name'], item['measurement_unit']
+    except (KeyError, TypeError):
+        name = unit = None
+    if not isinstance(name, str) or not isinstance(unit, str):
+        raise CommandError(
+            f'Элемент {number}: ожидается объект со строковыми полями '
+            f'name и measurement_unit')
+    return name, unit
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def normalize(chunk):
+    """ Убирает пустые строки и повторы внутри пачки. """
+    unique = {}
+    for name, unit in chunk:
+        name, unit = name.strip(), unit.strip()
+        if name and unit:
+            unique[(name, unit)] = None
+    return list(unique)
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с ингредиентами')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='Формат файла, по умолчанию по расширению')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY для PostgreSQL')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format in ('jsonl', 'ndjson'):
+            file_format = 'json'
+        if file_format not in ('csv', 'json'):
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        before = Ingredient.objects.count()
+        with open(path, encoding='utf-8', newline='') as file, \
+                transaction.atomic():
+            reader = read_csv if file_format == 'csv' else read_json
+            chunks = chunked(reader(file), options['chunk_size'])
+            if use_copy:
+                processed = self.copy(chunks)
+            else:
+                processed = self.bulk_create(chunks)
+        created = Ingredient.objects.count() - before
+        if created:
+            cache.bump_version('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {processed}, добавлено: {created}'))
+
+    def progress(self, processed):
+        self.stdout.write(f'Обработано строк: {processed}')
+
+    def bulk_create(self, chunks):
+        processed = 0
+        for chunk in chunks:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in normalize(chunk)],
+                ignore_conflicts=True
+            )
+            processed += len(chunk)
+            self.progress(processed)
+        return processed
+
+    def copy(self, chunks):
+        """ Загружает пачки во временную таблицу через COPY и переносит
+            новые строки одним INSERT ... ON CONFLICT DO NOTHING.
+        """
+        table = Ingredient._meta.db_table
+        processed = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            for chunk in chunks:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(normalize(chunk))
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_import (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                processed += len(chunk)
+                self.progress(processed)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+        return processed
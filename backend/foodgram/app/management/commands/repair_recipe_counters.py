@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from api import cache
+from app.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного и корзин рецептов '
+            'по промежуточным таблицам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Число id рецептов в одном UPDATE')
+
+    def handle(self, *args, **options):
+        last_id = Recipe.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        size = options['batch_size']
+        updated = 0
+        for start in range(0, last_id, size):
+            with transaction.atomic():
+                updated += Recipe.objects.filter(
+                    id__gt=start, id__lte=start + size).recount()
+            self.stdout.write(f'Обработано рецептов: {updated}')
+        cache.bump_version('recipes')
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитаны счётчики рецептов: {updated}'))
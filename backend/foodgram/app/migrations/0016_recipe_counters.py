@@ -0,0 +1,47 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('app', 'Recipe')
+    User = apps.get_model('users', 'User')
+    counters = {
+        'favorites_count': User.favorite_list.through,
+        'in_carts_count': User.cart.through,
+    }
+    Recipe.objects.update(**{
+        field: Coalesce(Subquery(
+            through.objects.filter(recipe_id=OuterRef('pk')).order_by(
+            ).values('recipe_id').annotate(total=Count('*')).values('total')
+        ), 0)
+        for field, through in counters.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_recipe_thumbnails'),
+        ('users', '0003_alter_user_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-pub_date', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
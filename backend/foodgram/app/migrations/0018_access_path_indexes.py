@@ -0,0 +1,37 @@
+# Generated by Django 3.2.19 on 2026-10-18 04:06
+
+from django.db import migrations, models
+
+# Промежуточные таблицы ManyToMany создаются автоматически, индексы
+# в обратном уникальному ключу порядке добавляются SQL-запросом:
+# (промежуточная таблица, индекс, столбцы).
+THROUGH_INDEXES = (
+    ('app_recipe_tags', 'recipe_tags_tag_recipe_idx', 'tag_id, recipe_id'),
+    ('users_user_favorite_list', 'favorite_recipe_user_idx',
+     'recipe_id, user_id'),
+    ('users_user_cart', 'cart_recipe_user_idx', 'recipe_id, user_id'),
+)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_shopping_list'),
+        ('users', '0003_alter_user_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['author', 'user'], name='subscription_author_user_idx'),
+        ),
+    ] + [
+        migrations.RunSQL(
+            f'CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns})',
+            f'DROP INDEX IF EXISTS {index}',
+        )
+        for table, index, columns in THROUGH_INDEXES
+    ]
@@ -1,5 +1,12 @@
+from collections import defaultdict
+
 from django.conf import settings
-from django.db import models
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import (BooleanField, Case, Count, Exists, F,
+                              IntegerField, OuterRef, Prefetch, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce
 
 from .validators import HexColorValidator, validate_not_zero
 
@@ -25,6 +32,26 @@ class Tag(models.Model):
         return self.name
 
 
+class IngredientQuerySet(models.QuerySet):
+    """ Набор запросов для ингредиентов """
+
+    def search(self, name, limit=None):
+        """ Поиск по подстроке: сначала совпадения с начала названия,
+            затем остальные, внутри групп по алфавиту.
+            В PostgreSQL поиск обслуживает триграммный GIN-индекс.
+        """
+        queryset = self.filter(name__icontains=name).annotate(
+            rank=Case(
+                When(name__istartswith=name, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        ).order_by('rank', 'name')
+        if limit:
+            queryset = queryset[:limit]
+        return queryset
+
+
 class Ingredient(models.Model):
     """ Модель ингредиента """
     name = models.CharField(max_length=200, blank=False,
@@ -33,7 +60,15 @@ class Ingredient(models.Model):
     measurement_unit = models.CharField(max_length=200, blank=False,
                                         null=False)
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
         verbose_name = 'ингредиент'
         verbose_name_plural = 'ингредиенты'
         ordering = ['id']
@@ -42,6 +77,83 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """ Набор запросов для рецептов """
+
+    def for_read(self, user):
+        """ Выборка рецептов для чтения: все связанные объекты
+            подгружаются заранее, флаги пользователя вычисляются в БД.
+        """
+        return self.prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ing',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient').order_by('id')
+            ),
+            Prefetch('author', queryset=self.authors(user)),
+        ).with_flags(user)
+
+    def with_flags(self, user):
+        return self.annotate(
+            is_favorited=self._user_flag(
+                self.model.user_favorite.through.objects.filter(
+                    recipe_id=OuterRef('pk')),
+                user
+            ),
+            is_in_shopping_cart=self._user_flag(
+                self.model.user_cart.through.objects.filter(
+                    recipe_id=OuterRef('pk')),
+                user
+            ),
+        )
+
+    def authors(self, user):
+        """ Авторы с флагом подписки пользователя. """
+        return get_user_model().objects.annotate(
+            is_subscribed=self._user_flag(
+                Subscription.objects.filter(author_id=OuterRef('pk')),
+                user
+            )
+        )
+
+    def in_user_list(self, related, user, value=True):
+        """ Рецепты из списка пользователя (value=True) или не из него.
+            Отрицание строится как NOT EXISTS: в отличие от NOT IN
+            с подзапросом, планировщик выполняет его как анти-соединение
+            по индексу промежуточной таблицы.
+        """
+        if not user.is_authenticated:
+            return self.none() if value else self
+        in_list = Exists(getattr(self.model, related).through.objects.filter(
+            recipe_id=OuterRef('pk'), user_id=user.id))
+        return self.filter(in_list if value else ~in_list)
+
+    def change_counter(self, field, delta):
+        """ Атомарно меняет счётчик без чтения текущего значения. """
+        return self.update(**{field: F(field) + delta})
+
+    def recount(self):
+        """ Пересчитывает счётчики по промежуточным таблицам
+            одним UPDATE с подзапросами.
+        """
+        return self.update(**{
+            field: Coalesce(Subquery(
+                getattr(self.model, related).through.objects.filter(
+                    recipe_id=OuterRef('pk')
+                ).order_by().values('recipe_id').annotate(
+                    total=Count('*')).values('total')
+            ), 0)
+            for field, related in self.model.COUNTERS.items()
+        })
+
+    @staticmethod
+    def _user_flag(queryset, user):
+        if not user.is_authenticated:
+            return Value(False, output_field=BooleanField())
+        return Exists(queryset.filter(user_id=user.id))
+
+
 class Recipe(models.Model):
     """ Модель рецепта """
     tags = models.ManyToManyField(Tag, blank=True)
@@ -57,6 +169,9 @@ class Recipe(models.Model):
                             blank=False
                             )
     image = models.ImageField('Изображение', upload_to='recipes/')
+    thumbnail = models.ImageField('Миниатюра', blank=True, editable=False)
+    thumbnail_webp = models.ImageField('Миниатюра WebP', blank=True,
+                                       editable=False)
     text = models.TextField(max_length=500, blank=False, null=False)
     cooking_time = models.PositiveSmallIntegerField(
         blank=False,
@@ -64,15 +179,52 @@ class Recipe(models.Model):
         validators=[validate_not_zero]
     )
     pub_date = models.DateTimeField(auto_now_add=True)
+    favorites_count = models.PositiveIntegerField('В избранном', default=0,
+                                                  editable=False)
+    in_carts_count = models.PositiveIntegerField('В корзинах', default=0,
+                                                 editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    # Счётчик -> обратная связь списка пользователей
+    COUNTERS = {
+        'favorites_count': 'user_favorite',
+        'in_carts_count': 'user_cart',
+    }
+    POPULAR_ORDERING = ('-favorites_count', '-pub_date', '-id')
 
     class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+            # Рецепты автора в порядке ленты: фильтр author
+            # и рецепты в подписках.
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
         verbose_name = 'рецепт'
         verbose_name_plural = 'рецепты'
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
 
     def __str__(self) -> str:
         return self.name
 
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        """ Счётчики меняются только атомарно через change_counter:
+            сохранение загруженного рецепта не перезаписывает их
+            прочитанными ранее значениями.
+        """
+        if (update_fields is None and not force_insert
+                and not self._state.adding):
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
@@ -114,6 +266,153 @@ class Subscription(models.Model):
                 name='unique_follow'
             )
         ]
+        # Подписчики автора без обращения к таблице
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='subscription_author_user_idx'),
+        ]
         verbose_name = 'подписка'
         verbose_name_plural = 'подписки'
         ordering = ['id']
+
+
+class RecipeSimilarity(models.Model):
+    """ Похожий рецепт: один из ближайших соседей рецепта по совместным
+        добавлениям в избранное и корзины. Таблицу заполняет команда
+        build_recommendations.
+    """
+    # Индекс по recipe_id не нужен, его покрывает индекс (recipe, -score)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='similar', db_index=False)
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                                related_name='similar_to')
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='recipe_similarity_score_idx'),
+        ]
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'похожие рецепты'
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """ Набор запросов для списков покупок """
+
+    def apply(self, deltas):
+        """ Прибавляет к спискам покупок изменения
+            {(user_id, ingredient_id): количество}. Строки пользователя
+            меняются под блокировкой его записи, обнулившиеся удаляются.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        user_ids = {user_id for user_id, _ in deltas}
+        # Ошибка откатывает внешнюю транзакцию целиком, точка
+        # сохранения не нужна.
+        with transaction.atomic(savepoint=False):
+            list(get_user_model().objects.select_for_update().filter(
+                id__in=user_ids).values_list('id', flat=True))
+            items = {
+                (item.user_id, item.ingredient_id): item
+                for item in self.filter(
+                    user_id__in=user_ids,
+                    ingredient_id__in={ing_id for _, ing_id in deltas})
+            }
+            created, updated, deleted = [], [], []
+            for (user_id, ingredient_id), delta in deltas.items():
+                item = items.get((user_id, ingredient_id))
+                if item is None:
+                    if delta > 0:
+                        created.append(self.model(
+                            user_id=user_id, ingredient_id=ingredient_id,
+                            amount=delta))
+                    continue
+                item.amount += delta
+                if item.amount > 0:
+                    updated.append(item)
+                else:
+                    deleted.append(item.id)
+            self.bulk_create(created)
+            self.bulk_update(updated, ['amount'])
+            if deleted:
+                self.filter(id__in=deleted).delete()
+
+    def add_recipes(self, links, sign=1):
+        """ Добавляет (sign=1) или вычитает (sign=-1) ингредиенты
+            рецептов по парам (user_id, recipe_id).
+        """
+        links = list(links)
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id, amount in (
+                RecipeIngredient.objects.filter(
+                    recipe_id__in={recipe_id for _, recipe_id in links}
+                ).values_list('recipe_id', 'ingredient_id', 'amount')):
+            ingredients[recipe_id].append((ingredient_id, amount))
+        deltas = defaultdict(int)
+        for user_id, recipe_id in links:
+            for ingredient_id, amount in ingredients[recipe_id]:
+                deltas[(user_id, ingredient_id)] += sign * amount
+        self.apply(deltas)
+
+    @staticmethod
+    def from_carts(user_ids=None):
+        """ Списки покупок, собранные заново по корзинам. """
+        rows = Recipe.user_cart.through.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        return {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in rows.filter(
+                recipe__recipe_ing__isnull=False
+            ).values_list(
+                'user_id', 'recipe__recipe_ing__ingredient_id'
+            ).annotate(
+                total=Sum('recipe__recipe_ing__amount')
+            ).order_by().iterator()
+        }
+
+    def rebuild(self, user_ids=None):
+        expected = self.from_carts(user_ids)
+        with transaction.atomic():
+            items = self.all()
+            if user_ids is not None:
+                items = items.filter(user_id__in=user_ids)
+            items.delete()
+            self.bulk_create([
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           amount=amount)
+                for (user_id, ingredient_id), amount in expected.items()
+            ], batch_size=5000)
+
+
+class ShoppingListItem(models.Model):
+    """ Строка списка покупок: суммарное количество ингредиента
+        по всем рецептам в корзине пользователя.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+        verbose_name = 'строка списка покупок'
+        verbose_name_plural = 'списки покупок'
@@ -32,6 +32,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.async_views.AsyncRoutesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,10 +72,25 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default=5432)
+        'PORT': os.getenv('DB_PORT', default=5432),
+        # Секунды жизни соединения: 0 — новое соединение на каждый
+        # запрос, None — без ограничения
+        'CONN_MAX_AGE': (
+            None if os.getenv('DB_CONN_MAX_AGE') == 'None'
+            else int(os.getenv('DB_CONN_MAX_AGE', default=60))
+        ),
+        # PgBouncer в режиме pool_mode = transaction не сохраняет
+        # серверные курсоры между транзакциями
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv(
+            'DB_PGBOUNCER', default='False') == 'True',
     }
 }
 
+# Проверка постоянного соединения перед каждым запросом
+DB_CONN_HEALTH_CHECKS = os.getenv(
+    'DB_CONN_HEALTH_CHECKS', default='True'
+) == 'True'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -95,7 +113,11 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
@@ -119,3 +141,92 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', default=50))
+
+# 'db' — поиск ингредиентов запросом к БД, 'memory' — по индексу в памяти
+INGREDIENT_SEARCH_ENGINE = os.getenv('INGREDIENT_SEARCH_ENGINE', default='db')
+
+INGREDIENT_SEARCH_INDEX_TTL = int(
+    os.getenv('INGREDIENT_SEARCH_INDEX_TTL', default=300)
+)
+
+# Для нескольких процессов gunicorn нужен общий кэш (Redis из
+# docker-compose): кэш в памяти процесса тогда не используется для ответов
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+# Число процессов сервера: кэш в памяти процесса при нескольких
+# процессах не используется для ответов
+WEB_WORKERS = int(os.getenv('GUNICORN_WORKERS', default=1))
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=3600))
+
+# Кэш токенов: общий и в памяти процесса, 0 отключает кэш процесса
+AUTH_CACHE_TIMEOUT = int(os.getenv('AUTH_CACHE_TIMEOUT', default=300))
+AUTH_LOCAL_CACHE_TIMEOUT = int(
+    os.getenv('AUTH_LOCAL_CACHE_TIMEOUT', default=10)
+)
+AUTH_LOCAL_CACHE_SIZE = int(os.getenv('AUTH_LOCAL_CACHE_SIZE', default=1024))
+
+# Потоки для создания миниатюр рецептов, 0 — в потоке запроса
+IMAGE_PROCESSING_WORKERS = int(
+    os.getenv('IMAGE_PROCESSING_WORKERS', default=2)
+)
+
+RECIPE_THUMBNAIL_SIZE = os.getenv('RECIPE_THUMBNAIL_SIZE', default='400x400')
+
+RECIPE_THUMBNAIL_QUALITY = int(
+    os.getenv('RECIPE_THUMBNAIL_QUALITY', default=80)
+)
+
+# Предельный размер изображения рецепта после декодирования base64, байт
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', default=10 * 1024 * 1024)
+)
+
+# Чтение рецептов без полей DRF: словари строятся из строк .values()
+COMPILED_RECIPE_SERIALIZER = os.getenv(
+    'COMPILED_RECIPE_SERIALIZER', default='True'
+) == 'True'
+
+# Профилирование запросов: 'off', 'header' — только запросы с заголовком
+# X-Profile, равным PROFILING_SECRET, 'on' — все запросы
+PROFILING = os.getenv('PROFILING', default='off')
+
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', default='')
+
+# Сколько одинаковых SQL-запросов за запрос считать признаком N+1
+PROFILING_DUPLICATE_THRESHOLD = int(
+    os.getenv('PROFILING_DUPLICATE_THRESHOLD', default=3)
+)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', default='True') == 'True'
+
+# Общий каталог для метрик процессов gunicorn, очищается при запуске.
+# Пустое значение — /metrics отдаёт метрики только своего процесса.
+METRICS_DIR = os.getenv('METRICS_DIR', default='')
+
+METRICS_FLUSH_INTERVAL = float(
+    os.getenv('METRICS_FLUSH_INTERVAL', default=5)
+)
+
+# Потоки для маршрутов чтения под ASGI: Django 3.2 обращается к ORM
+# только синхронно
+ASGI_READ_THREADS = int(os.getenv('ASGI_READ_THREADS', default=16))
+
+# Маршруты чтения в пуле потоков под ASGI (foodgram.urls_asgi),
+# по умолчанию ASGI обслуживает те же представления, что и WSGI
+ASGI_READ_ROUTES = os.getenv('ASGI_READ_ROUTES', default='False') == 'True'
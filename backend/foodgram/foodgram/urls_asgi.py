@@ -0,0 +1,11 @@
+from django.urls import include, path
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+# Те же маршруты, что и в foodgram.urls, но маршруты чтения API
+# обслуживаются async-представлениями.
+urlpatterns = [
+    path('api/', include('api.urls_asgi')),
+    *[pattern for pattern in wsgi_urlpatterns
+      if getattr(pattern, 'namespace', None) != 'api'],
+]
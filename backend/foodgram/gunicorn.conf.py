@@ -0,0 +1,45 @@
+import os
+import shutil
+
+bind = os.getenv('GUNICORN_BIND', default='0:8000')
+
+# Как и без конфигурации — один процесс. Несколько процессов требуют
+# общего кэша (CACHE_BACKEND) и METRICS_DIR.
+workers = int(os.getenv('GUNICORN_WORKERS', default=1))
+
+# sync — по процессу на запрос, gthread — потоки внутри процесса,
+# у каждого потока своё постоянное соединение с БД
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', default='sync')
+
+threads = int(os.getenv('GUNICORN_THREADS', default=1))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', default=30))
+
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', default=2))
+
+# Перезапуск процесса после max_requests запросов ограничивает рост памяти
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', default=0))
+
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER',
+                                    default=0))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', default='False') == 'True'
+
+
+def on_starting(server):
+    """ Метрики прошлого запуска из METRICS_DIR не суммируются
+        с новыми процессами.
+    """
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def pre_fork(server, worker):
+    """ Соединения с БД, открытые мастером при preload_app, закрываются
+        до fork, чтобы процессы не делили один сокет.
+    """
+    if preload_app:
+        from django.db import connections
+        connections.close_all()